@@ -14,7 +14,7 @@ INDEX_PATH = os.path.join("data", "activity_index.parquet")
 def main(page: ft.Page):
     print("window", page.width)
 
-    act_index = dataf.load_parquet(INDEX_PATH)
+    act_index = dataf.load_index(INDEX_PATH)
     summary = statsf.summary_interval(act_index, "1mo")
     fig_summary = plotf.summary_hist(summary)
 
@@ -1,10 +1,35 @@
+import os
+
 import dash
+import flask
 from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
 
+from app_functions import data_functions as dataf
+from app_functions import plot_functions as plotf
 
 app = Dash(__name__, use_pages=True, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
+HEATMAP_DIR = os.path.join("data", "heatmap_tiles")
+heatmap_tiles = dataf.HeatmapTiles(HEATMAP_DIR)
+
+
+@app.server.route("/heatmap/<int:z>/<int:x>/<int:y>.png")
+def heatmap_tile(z: int, x: int, y: int):
+    """Heatmap tile for map layers, PNG cached next to the tile counts."""
+    counts_path = heatmap_tiles.tile_path(z, x, y)
+    if not os.path.exists(counts_path):
+        return flask.Response(status=204)
+
+    png_path = counts_path[:-4] + ".png"
+    if (
+        not os.path.exists(png_path)
+        or os.stat(png_path).st_mtime_ns < os.stat(counts_path).st_mtime_ns
+    ):
+        dataf.safe_save(plotf.heatmap_png(heatmap_tiles.counts(z, x, y)), png_path)
+    return flask.send_file(os.path.abspath(png_path), mimetype="image/png")
+
+
 info_store = html.Div(
     [html.H3("output", className="title"), dcc.Markdown("output...", id="info-store")]
 )
@@ -3,6 +3,9 @@ import gpxpy.gpx
 import pandas as pd
 from plotly import express as px, graph_objects as go
 
+from app_functions import data_functions as dataf
+from app_functions import stats_functions as statsf
+
 
 class Act:
     """Object representing an activity with one track and some metadata"""
@@ -78,6 +81,26 @@ class Act:
 
         return cls(metadata=None, points=points_df)
 
+    @classmethod
+    def from_gpx(cls, filepath: str):
+        """Create Act object from a gpx file, without building a gpxpy object.
+
+        Uses the streaming reader, so all tracks and segments are included."""
+        metadata, points = dataf.load_gpx_polars(filepath)
+        assert not points.is_empty(), "Incompatible GPX"
+
+        factor = 2**31 / 180  # semicircles to degrees
+        points_df = pd.DataFrame.from_dict(
+            {
+                "lon": (points["long"] / factor).to_numpy(),
+                "lat": (points["lat"] / factor).to_numpy(),
+                "elev": points["alt_enh"].to_numpy(),
+                "time": pd.to_datetime(points["time"].to_numpy(), utc=True),
+            },
+        )
+
+        return cls(name=metadata.get("name"), metadata=metadata, points=points_df)
+
     @classmethod
     def from_dict(cls, d: dict):
         """Create Act object from a dict.
@@ -102,9 +125,13 @@ class Act:
         d = {s: getattr(self, s, None) for s in self.__slots__}
         return d
 
-    def plot_trace(self, show_grid=False) -> go.Figure:
-        """Plot a trace of the activity."""
+    def plot_trace(self, show_grid=False, max_points=dataf.LOD_MAX_POINTS) -> go.Figure:
+        """Plot a trace of the activity, simplified to at most max_points."""
         p = self.points
+        if len(p) > max_points:
+            factor = 2**31 / 180  # degrees to semicircles
+            tolerances = statsf.track_tolerances(p["lat"] * factor, p["long"] * factor)
+            p = p.iloc[statsf.lod_indices(tolerances, max_points)]
 
         hov_tmp = "<br>".join(
             [
@@ -1,9 +1,26 @@
 import fnmatch
 import gzip
+import hashlib
+import io
 import json
 import os
+import re
 import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from datetime import timezone
+from functools import lru_cache
 from glob import glob
+from itertools import groupby, islice
+from math import pi
+from multiprocessing import get_context
+from typing import Literal
 
 import fitdecode
 import gpxpy
@@ -11,11 +28,43 @@ import gpxpy.gpx
 import numpy as np
 import pandas as pd
 import polars as pl
+from lxml import etree
+
+from app_functions import stats_functions as statsf
 
 
 # CONSTANTS
 
-IMPORT_TYPES = [".gpx", ".gpx.gz", ".fit", ".fit.gz", ".json", ".json.gz"]
+IMPORT_TYPES = [
+    ".gpx",
+    ".gpx.gz",
+    ".fit",
+    ".fit.gz",
+    ".json",
+    ".json.gz",
+    ".tcx",
+    ".tcx.gz",
+    ".kml",
+    ".kml.gz",
+    ".csv",
+    ".csv.gz",
+]
+# archives scanned for importable members, read without extracting
+ARCHIVE_TYPES = (".zip",)
+ZIP_MEMBER_RE = re.compile(r"\.zip[\\/]", re.IGNORECASE)
+# types that convert_polars can read
+CONVERT_TYPES = [t for t in IMPORT_TYPES if not t.startswith(".json")]
+# errors of reading or decoding one source file, it is reported and skipped
+SOURCE_ERRORS = (
+    ValueError,
+    OSError,
+    EOFError,
+    zlib.error,
+    zipfile.BadZipFile,
+    fitdecode.FitError,
+    etree.LxmlError,
+    pl.exceptions.PolarsError,
+)
 DEF_PL_PARQ_SCH = {
     "time": pl.Datetime(time_unit="us", time_zone="UTC"),
     "lat": pl.Null,
@@ -24,10 +73,147 @@ DEF_PL_PARQ_SCH = {
     "alt_enh": pl.Null,
     "hr": pl.UInt16,
 }
+# points loaded from compact files, see ``encode_compact``
+COMPACT_SCHEMA = {
+    "time": pl.Datetime(time_unit="us", time_zone="UTC"),
+    "lat": pl.Int32,
+    "long": pl.Int32,
+    "speed_enh": pl.Float32,
+    "alt_enh": pl.Float32,
+    "hr": pl.UInt8,
+}
+# column: (stored dtype, scale, delta order). Speed is stored in mm/s and
+# altitude in 0.2 m (the FIT resolutions), time in us since unix epoch.
+COMPACT_ENCODING = {
+    "time": (pl.Int64, 1, 1),
+    "lat": (pl.Int64, 1, 2),
+    "long": (pl.Int64, 1, 2),
+    "speed_enh": (pl.Int32, 1000, 1),
+    "alt_enh": (pl.Int32, 5, 1),
+    "hr": (pl.UInt8, 1, 0),
+}
+# higher levels are slower to write, and give no smaller files
+COMPACT_ZSTD_LEVEL = 15
+# csv column names (lowercase) to point columns
+CSV_COLUMNS = {
+    "time": "time",
+    "timestamp": "time",
+    "lat": "lat",
+    "latitude": "lat",
+    "position_lat": "lat",
+    "lon": "long",
+    "long": "long",
+    "longitude": "long",
+    "position_long": "long",
+    "ele": "alt_enh",
+    "elevation": "alt_enh",
+    "altitude": "alt_enh",
+    "alt_enh": "alt_enh",
+    "enhanced_altitude": "alt_enh",
+    "speed": "speed_enh",
+    "speed_enh": "speed_enh",
+    "enhanced_speed": "speed_enh",
+    "hr": "hr",
+    "heart_rate": "hr",
+}
+# rows per parquet row group for activity points, so that loading a time
+# range can skip parts of long activities (about 30 min at 1 s sampling)
+POINTS_ROW_GROUP_SIZE = 2048
+# slowest speed (m/s) between points counted as moving time in the index
+MOVING_MIN_SPEED = 0.5
+# grid of ``SpatialIndex``: cell size (degrees), and most cells per activity,
+# activities with larger bounding boxes are checked in every query
+SPATIAL_CELL_DEG = 0.1
+SPATIAL_MAX_CELLS = 64
+# grid cell size (degrees) of ``activity_regions``, about 5 km
+REGION_CELL_DEG = 0.05
+# level of detail of plotted tracks, see ``lod_points``: most points sent to
+# a plot, smallest tolerance (m) stored, and minmax levels (2**k buckets)
+LOD_MAX_POINTS = 2000
+LOD_MIN_TOLERANCE_M = 1.0
+LOD_ALT_LEVELS = range(4, 11)
+# heatmap tiles (web mercator z/x/y), see ``HeatmapTiles``
+HEATMAP_TILE_SIZE = 256
+HEATMAP_MAX_ZOOM = 14
+# largest distance (m) of an effort from a segment, see ``segment_efforts``
+SEGMENT_TOLERANCE_M = 25.0
+# part of the cache key, increase when the matching changes
+SEGMENT_MATCH_VERSION = 2
+SEGMENT_EFFORTS_SCHEMA = {
+    "id": pl.String,
+    "file_mtime_ns": pl.Int64,
+    "start_time": pl.Datetime(time_unit="us", time_zone="UTC"),
+    "end_time": pl.Datetime(time_unit="us", time_zone="UTC"),
+    "elapsed": pl.Duration(time_unit="us"),
+}
+# points of all activities in one dataset, see ``migrate_points_dataset``
+DATASET_SCHEMA = {
+    "id": pl.String,
+    "time": pl.Datetime(time_unit="us", time_zone="UTC"),
+    "lat": pl.Int64,
+    "long": pl.Int64,
+    "speed_enh": pl.Float64,
+    "alt_enh": pl.Float64,
+    "hr": pl.UInt16,
+}
+MANIFEST_SCHEMA = {
+    "path": pl.String,
+    "size": pl.Int64,
+    "mtime_ns": pl.Int64,
+    "hash": pl.String,
+    "outputs": pl.List(pl.String),
+}
+
+# FIT protocol, for decoding without fitdecode
+FIT_EPOCH = 631065600  # 1989-12-31T00:00:00Z as unix time
+FIT_DATETIME_MIN = 0x10000000  # smaller timestamps are relative, not dates
+FIT_MESG_SPORT = 12
+FIT_MESG_RECORD = 20
+# base type id: (numpy format, invalid value)
+FIT_BASE_TYPES = {
+    0x00: ("u1", 0xFF),
+    0x01: ("i1", 0x7F),
+    0x02: ("u1", 0xFF),
+    0x83: ("i2", 0x7FFF),
+    0x84: ("u2", 0xFFFF),
+    0x85: ("i4", 0x7FFFFFFF),
+    0x86: ("u4", 0xFFFFFFFF),
+    0x0A: ("u1", 0x00),
+    0x8B: ("u2", 0x0000),
+    0x8C: ("u4", 0x00000000),
+}
+# column: candidate "record" fields as (field number, scale, offset).
+# speed (6) and altitude (2) expand to their enhanced field, as in fitdecode
+# the first one present in the definition is used.
+FIT_RECORD_FIELDS = {
+    "time": [(253, None, None)],
+    "lat": [(0, None, None)],
+    "long": [(1, None, None)],
+    "speed_enh": [(6, 1000, None), (73, 1000, None)],
+    "alt_enh": [(2, 5, 500), (78, 5, 500)],
+    "hr": [(3, None, None)],
+}
+
+
+def fit_crc_table():
+    """Lookup table for the FIT CRC-16 (poly 0xA001), one entry per byte."""
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+FIT_CRC_TABLE = fit_crc_table()
 
 
 def unzip_gz(folder: str, file: str, overwrite=False):
     """Unzip a file and save a copy.
+
+    Not needed for importing, all loaders read compressed files directly
+    (see ``open_source``).
     ## Parameters
     - folder
     - file
@@ -46,45 +232,171 @@ def unzip_gz(folder: str, file: str, overwrite=False):
     return True
 
 
+def open_source(filepath: str, data: bytes = None):
+    """Open an activity file for binary reading, decompressing if needed.
+
+    Compressed files are decompressed while reading, nothing is written to disk.
+
+    ## Parameters
+    - filepath (str): compressed if ending with ".gz".
+    - data (bytes): decompressed content, if already read (see ``read_source``).
+        Then filepath is only used for its name.
+
+    ## Returns
+    - file (binary file object)
+    """
+    if data is not None:
+        return io.BytesIO(data)
+    if split_zip_path(filepath)[1] is not None:
+        return io.BytesIO(read_source(filepath))
+    if filepath[-3:] == ".gz":
+        return gzip.open(filepath, "rb")
+    return open(filepath, "rb")
+
+
+def read_source(filepath: str) -> bytes:
+    """Read the full, decompressed, content of an activity file.
+
+    Also reads members of zip archives, given as "archive.zip/member".
+    """
+    archive, member = split_zip_path(filepath)
+    if member is not None:
+        data = open_zip(archive).read(member)
+    else:
+        with open(filepath, "rb") as f:
+            data = f.read()
+    if filepath[-3:] == ".gz":
+        data = gzip.decompress(data)  # zlib releases the GIL
+    return data
+
+
+def split_zip_path(filepath: str) -> tuple[str, str]:
+    """Split a path like "export.zip/activities/1.fit.gz" at the archive.
+
+    ## Returns
+    - archive (str): path of the zip file, or filepath if not in an archive.
+    - member (str|None): name inside the archive.
+    """
+    m = ZIP_MEMBER_RE.search(filepath)
+    if m is None:
+        return filepath, None
+    return filepath[: m.end() - 1], filepath[m.end() :].replace(os.sep, "/")
+
+
+def open_zip(archive: str) -> zipfile.ZipFile:
+    """Open a zip archive for reading members, reusing an open one.
+
+    Reading the member list of a large archive is not free, so open archives
+    are kept per process, until the archive file changes.
+    """
+    stat = os.stat(archive)
+    return open_zip_cached(archive, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=4)
+def open_zip_cached(archive: str, mtime_ns: int, size: int) -> zipfile.ZipFile:
+    """See ``open_zip``, modification time and size are part of the cache key."""
+    return zipfile.ZipFile(archive)
+
+
+def zip_members(archive: str, extensions=IMPORT_TYPES) -> list[zipfile.ZipInfo]:
+    """List members of a zip archive with one of the extensions."""
+    extensions = tuple(extensions)
+    return [
+        info
+        for info in open_zip(archive).infolist()
+        if not info.is_dir() and info.filename.endswith(extensions)
+    ]
+
+
+def zip_member_mtime_ns(info: zipfile.ZipInfo) -> int:
+    """Modification time of a zip member, stored as local time in the archive."""
+    return int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000
+
+
+def prefetch_sources(files: list[str], ahead=4, workers=2):
+    """Read and decompress files on a thread pool, ahead of their use.
+
+    Lets decompression and disk reads of the next files overlap with parsing
+    of the current one.
+
+    ## Parameters
+    - files (list[str])
+    - ahead (int): max number of files read but not yet used.
+    - workers (int): number of reading threads.
+
+    ## Yields
+    - (filepath, data): in the order of files. data is None if the file could
+        not be read (one of ``SOURCE_ERRORS``), the error is raised again when
+        the caller reads it itself.
+    """
+    files = iter(files)
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque(
+            (fp, pool.submit(read_source, fp)) for fp in islice(files, ahead)
+        )
+        while pending:
+            fp, future = pending.popleft()
+            for fp_next in islice(files, 1):
+                pending.append((fp_next, pool.submit(read_source, fp_next)))
+            try:
+                data = future.result()
+            except SOURCE_ERRORS:
+                data = None
+            yield fp, data
+
+
 def index_activities_gpx(folder: str, old_index=None, verbose=False) -> dict[str]:
-    """Create or update(TODO) a index of all gpx-files in activities folder.
+    """Create or update a index of all gpx-files in activities folder.
 
     The index is a dict indexed by ``id``, containing dicts with basic information.
+    Files are read with ``load_gpx_polars``, multiple tracks and segments are
+    indexed as one activity.
+
+    With an old index, files with the same size and modification time as when
+    indexed are not read again, and files that no longer exist are dropped.
 
     ## Parameters
     - folder (str): location to search for gpx-files.
-    - old_index (TODO)
+    - old_index (dict): index from an earlier call, to update.
 
     ## Returns
     - index (dict)
     """
     filenames = glob("*.gpx", root_dir=folder)
+    old_acts = old_index["activities"] if old_index is not None else dict()
+
+    # old entries first, in their order, then new files
+    order = {file: i for i, file in enumerate(old_acts)}
+    filenames.sort(key=lambda file: order.get(file, len(order)))
 
     act_index = dict()
     act_index["activities"] = dict()
 
+    n_unchanged = 0
     for i, file in enumerate(filenames):
-        # load a gpx
-        with open(os.path.join(folder, file), encoding="utf8") as f:
-            gpx: gpxpy.gpx.GPX = gpxpy.parse(f, "lxml")
+        stat = os.stat(os.path.join(folder, file))
+        old_info = old_acts.get(file)
+        if (
+            old_info is not None
+            and old_info.get("file_size") == stat.st_size
+            and old_info.get("file_mtime_ns") == stat.st_mtime_ns
+        ):
+            act_index["activities"][file] = old_info
+            n_unchanged += 1
+            continue
+
+        metadata, points = load_gpx_polars(os.path.join(folder, file))
 
         # check file assumptions
-        if len(gpx.tracks) > 1:
-            print(f"Multiple tracks not supported, excluding {file}")
-            continue
-        if not (gpx.tracks):
-            print(f"No tracks, excluding {file}")
-            continue
-        if len(gpx.tracks[0].segments) > 1:
-            print(f"Multiple segments not supported, excluding {file}")
-            continue
-        if not (gpx.tracks[0].segments):
-            print(f"No segments, excluding {file}")
+        if points.is_empty():
+            print(f"No points, excluding {file}")
             continue
 
-        track = gpx.tracks[0]
         # extract metadata
-        act_info = info_from_gpx_track(track)
+        act_info = info_from_gpx_points(metadata, points)
+        act_info["file_size"] = stat.st_size
+        act_info["file_mtime_ns"] = stat.st_mtime_ns
 
         # add to index
         act_index["activities"][file] = act_info
@@ -94,9 +406,12 @@ def index_activities_gpx(folder: str, old_index=None, verbose=False) -> dict[str
 
         print(f"indexed file {i+1}/{len(filenames)}.")
 
+    if old_index is not None:
+        print(f"{n_unchanged}/{len(filenames)} files unchanged since indexed.")
+
     # add metadata to index
     now = pd.Timestamp.now()
-    act_index["created"] = now
+    act_index["created"] = old_index["created"] if old_index is not None else now
     act_index["updated"] = now
     return act_index
 
@@ -130,326 +445,3500 @@ def index_activities_polars(acts: dict[str, pl.DataFrame]) -> pl.DataFrame:
     return act_index
 
 
-def info_from_gpx_track(track) -> dict[str]:
-    """Extract common metadata from a gpx_track"""
-    act_info = dict()
-    act_info["name"] = track.name
-    act_info["desc"] = track.description
-    act_info["comment"] = track.comment
-    act_info["type"] = track.type
-    act_info["source"] = track.source
-    act_info["n_points"] = len(track.segments[0].points)
-    act_info["length2d_m"] = track.length_2d()  # lat,long-length [m]
-    act_info["length3d_m"] = track.length_3d()  # lat,long,elev-length [m]
-
-    act_info["time_start"] = track.get_time_bounds().start_time
-    act_info["time_end"] = track.get_time_bounds().end_time
-    return act_info
-
-
-def check_index(act_index: dict):
-    """Check index for duplicates and more"""
+def scan_point_files(files: list[str]) -> pl.LazyFrame:
+    """Lazy scan of many activity point files as one frame.
 
-    info = []
+    Files where a column has Null type (e.g. no position) are cast to the
+    common types of ``DATASET_SCHEMA``. Compact files (see
+    ``encode_compact``) are decoded per activity. Rows are in the order of
+    files, whatever their format.
 
-    info.append("index created : %s" % act_index["created"])
-    info.append("index updated : %s" % act_index["updated"])
-    info.append("since update  : %s" % (pd.Timestamp.now() - act_index["updated"]))
+    ## Returns
+    - points (pl.LazyFrame): columns of ``DATASET_SCHEMA``, "id" from the
+        file names.
+    """
+    schema = {k: v for k, v in DATASET_SCHEMA.items() if k != "id"}
+    # footers are read on threads, the format is only known from the schema
+    with ThreadPoolExecutor(4) as pool:
+        compact = list(pool.map(is_compact, files))
+
+    def scan(paths, schema):
+        return pl.scan_parquet(
+            paths,
+            schema=schema,
+            include_file_paths="path",
+            cast_options=pl.ScanCastOptions(integer_cast="upcast"),
+        ).with_columns(id=pl.col("path").str.extract(r"([^/\\.]+)[^/\\]*$"))
+
+    # one scan per run of files in the same format
+    stored = {k: COMPACT_ENCODING[k][0] for k in schema}
+    frames = []
+    for is_run_compact, run in groupby(zip(files, compact), key=lambda f: f[1]):
+        paths = [fp for fp, _ in run]
+        if is_run_compact:
+            frames.append(decode_compact(scan(paths, stored), over="id"))
+        else:
+            frames.append(scan(paths, schema))
+    if not frames:
+        frames.append(scan([], schema))
+    return pl.concat(
+        [f.select(pl.col(k).cast(v) for k, v in DATASET_SCHEMA.items()) for f in frames]
+    )
 
-    acts = act_index["activities"]
-    duplicates = find_duplicates(acts)
 
-    info.append("activity count: %s" % len(acts))
-    info.append("found duplicates :%s" % len(duplicates))
+def index_points_lazy(points: pl.LazyFrame) -> pl.LazyFrame:
+    """Index activities with one grouped query over their points.
 
-    return info
+    Same columns as ``index_activities_polars``, and per activity:
+    - length (m, small-angle distance between successive points, as
+        ``statsf.trace_distance``) and bounding box (semicircles).
+    - start_lat/long and end_lat/long: first and last position (semicircles).
+    - length_3d (m): with the smoothed altitude changes
+        (``statsf.step_distance_3d``).
+    - elev_gain, elev_loss (m): sums of smoothed altitude increases and
+        decreases (``statsf.step_altitude``), robust to altitude noise.
+    - moving_time: time of steps faster than ``MOVING_MIN_SPEED``, avg_speed
+        (m/s) is length over moving time.
+    - max_speed (m/s): from speed_enh, or between points without speed.
+    - avg_hr, max_hr (bpm)
+    - point_density (points per km)
 
+    Run with ``collect(engine="streaming")`` to process the points in batches.
 
-def find_duplicates(acts: dict):
-    matches = []
-    act_list = list(acts.values())
-    names_list = list(acts.keys())
+    ## Parameters
+    - points (pl.LazyFrame): points of activities in order, with an "id"
+        column, from ``scan_point_files`` or ``scan_points_dataset``.
 
-    for i, a1 in enumerate(act_list[:-1]):
-        for j in range(i + 1, len(act_list)):
-            a2 = act_list[j]
-            if a1 == a2:
-                matches.append((i, j))
-    return [(names_list[i], names_list[j]) for i, j in matches]
+    ## Returns
+    - act_index (pl.LazyFrame)
+    """
+    step = statsf.step_distance("small-angle")
+    step_time = pl.col("time").diff()
+    step_speed = step / (step_time.dt.total_microseconds() / 1e6)
+    step_alt = statsf.step_altitude()
+
+    return (
+        points.group_by("id", maintain_order=True)
+        .agg(
+            n_points=pl.len(),
+            start_time=pl.col("time").first(),
+            end_time=pl.col("time").last(),
+            mid_long=pl.col("long").mean(),
+            mid_lat=pl.col("lat").mean(),
+            length=step.sum().round().cast(pl.UInt32),
+            length_3d=statsf.step_distance_3d("small-angle")
+            .sum()
+            .round()
+            .cast(pl.UInt32),
+            min_lat=pl.col("lat").min(),
+            max_lat=pl.col("lat").max(),
+            min_long=pl.col("long").min(),
+            max_long=pl.col("long").max(),
+            start_lat=pl.col("lat").drop_nulls().first(),
+            start_long=pl.col("long").drop_nulls().first(),
+            end_lat=pl.col("lat").drop_nulls().last(),
+            end_long=pl.col("long").drop_nulls().last(),
+            elev_gain=step_alt.clip(lower_bound=0).sum().cast(pl.Float32),
+            elev_loss=-step_alt.clip(upper_bound=0).sum().cast(pl.Float32),
+            moving_time=step_time.filter(step_speed >= MOVING_MIN_SPEED).sum(),
+            max_speed=pl.coalesce(
+                pl.col("speed_enh").max(),
+                step_speed.filter(step_speed.is_finite()).max(),
+            ).cast(pl.Float32),
+            avg_hr=pl.col("hr").mean().cast(pl.Float32),
+            max_hr=pl.col("hr").max(),
+        )
+        .with_columns(
+            duration=pl.col("end_time") - pl.col("start_time"),
+            avg_speed=pl.when(pl.col("moving_time").dt.total_seconds() > 0)
+            .then(pl.col("length") / pl.col("moving_time").dt.total_seconds())
+            .cast(pl.Float32),
+            point_density=pl.when(pl.col("length") > 0)
+            .then(pl.col("n_points") / (pl.col("length") / 1000))
+            .cast(pl.Float32),
+        )
+    )
 
 
-def serialize_json(obj):
-    """Create resonable serializations for datatypes used here."""
-    if isinstance(obj, pd.Timestamp):
-        return obj.isoformat()
-    if isinstance(obj, pd.DataFrame):
-        return obj.to_dict(orient="dict")
-    raise TypeError("cannot serialize object (%s)" % type(obj))
+def point_file_stats(act_dir: str, act_ids: list[str] = None) -> pl.DataFrame:
+    """Size and modification time of activity point files.
 
+    Stored in the index as "file_size" and "file_mtime_ns", so
+    ``update_index`` can tell which activities changed since indexing.
 
-def load_act_index(filepath) -> dict:
-    """Load activity index from JSON.
+    ## Parameters
+    - act_dir (str): folder with .parquet files.
+    - act_ids (list[str]): Stat only these, all files in act_dir if None.
 
     ## Returns
-    - act_index (dict): with keys 'activities', 'updated' and 'created'.
-        - 'activities' is a list of dicts with keys 'name'...
+    - stats (pl.DataFrame): id, file_size, file_mtime_ns
     """
-    with open(filepath, encoding="utf8") as f:
-        act_index = json.load(f)
+    if act_ids is None:
+        sources = scan_sources(act_dir, [".parquet"])
+        return sources.select(
+            id=pl.col("path").str.extract(r"([^/\\.]+)[^/\\]*$"),
+            file_size=pl.col("size"),
+            file_mtime_ns=pl.col("mtime_ns"),
+        )
+    rows = []
+    for a in act_ids:
+        stat = os.stat(os.path.join(act_dir, a + ".parquet"))
+        rows.append((a, stat.st_size, stat.st_mtime_ns))
+    return pl.DataFrame(
+        rows,
+        schema={"id": pl.String, "file_size": pl.Int64, "file_mtime_ns": pl.Int64},
+        orient="row",
+    )
 
-    # convert to datetime
-    act_index["updated"] = pd.Timestamp(act_index["updated"])
-    act_index["created"] = pd.Timestamp(act_index["created"])
 
-    for k in act_index["activities"].keys():
-        act_index["activities"][k]["time_start"] = pd.Timestamp(
-            act_index["activities"][k]["time_start"]
-        )
-        act_index["activities"][k]["time_end"] = pd.Timestamp(
-            act_index["activities"][k]["time_end"]
-        )
-    return act_index
+def build_index(act_dir: str) -> pl.DataFrame:
+    """Index all activity point files in a folder, in one streaming pass."""
+    stats = point_file_stats(act_dir)
+    if stats.is_empty():
+        raise ValueError(f"no point files in {act_dir}")
+    files = [os.path.join(act_dir, a + ".parquet") for a in stats["id"]]
+    act_index = index_points_lazy(scan_point_files(files)).collect(engine="streaming")
+    return act_index.join(stats, on="id", how="left", maintain_order="left")
 
 
-def load_parquet(filepath: str, cols_required: set = None):
-    """Load a parquet file.
+def update_index(
+    old_index: pl.DataFrame, act_dir: str, verbose: bool = False
+) -> pl.DataFrame:
+    """Update an index to the current activity point files.
+
+    Only activities whose file is new, or changed size or modification time,
+    are indexed again (with ``index_activity_files``). Activities without file
+    are dropped. Rows keep their position, new rows are appended, and the
+    columns and dtypes of old_index are kept. An index without file stats
+    (made before ``point_file_stats``) is indexed again completely.
 
     ## Parameters
-    - filepath (str)
-    - cols_required (set): Raise ValueError if column missing/of null type.
+    - old_index (pl.DataFrame): e.g. from ``load_index``.
+    - act_dir (str): folder with .parquet and _meta.json files.
+    - verbose (bool)
 
     ## Returns
-    - Dataframe (pl.DataFrame)
+    - act_index (pl.DataFrame)
     """
-    if cols_required:
-        lazy = pl.scan_parquet(filepath)  # TODO: read_parquet_schema better?
-        for col in cols_required:
-            if col not in lazy.columns:
-                raise ValueError(f"missing column {col}")
-            if lazy.schema[col] == pl.Null:
-                raise ValueError(f"column {col} of Null type")
-        return lazy.collect()
+    stat_cols = ["file_size", "file_mtime_ns"]
+    stats = point_file_stats(act_dir)
+    if all(c in old_index.columns for c in stat_cols):
+        old_stats = old_index.select("id", *stat_cols)
     else:
-        return pl.read_parquet(filepath)
+        old_stats = pl.DataFrame(schema=stats.schema)
 
+    # (id, size, mtime) not in old index: new or changed
+    changed = stats.join(old_stats, on=["id", *stat_cols], how="anti")["id"]
+    kept = old_index.with_row_index("_pos").filter(
+        pl.col("id").is_in(stats["id"].implode())
+        & ~pl.col("id").is_in(changed.implode())
+    )
+    if verbose:
+        n_removed = len(old_index) - len(kept) - changed.is_in(old_index["id"]).sum()
+        print(f"{len(changed)} new/changed, {n_removed} removed activities")
+    if changed.is_empty():
+        return kept.drop("_pos")
+
+    rows = index_activity_files(act_dir, changed.to_list())
+    columns = old_index.columns + [c for c in stat_cols if c not in old_index.columns]
+    rows = rows.select(
+        pl.col(c) if c in rows.columns else pl.lit(None).alias(c) for c in columns
+    ).cast({c: d for c, d in old_index.schema.items() if d != pl.Null}, strict=False)
+    rows = rows.join(old_index.select("id").with_row_index("_pos"), on="id", how="left")
+    return (
+        pl.concat([kept, rows], how="diagonal_relaxed")
+        .sort("_pos", nulls_last=True, maintain_order=True)
+        .drop("_pos")
+    )
 
-def save_json(filepath, obj):
-    """Save object as JSON.
 
-    ## Parameters
-    - filepath (str): destination file. Will be compressed if ends with '.gz'."""
+def index_activity_files(act_dir: str, act_ids: list[str]) -> pl.DataFrame:
+    """Index rows for converted activities, with length and metadata.
 
-    if filepath[-3:] == ".gz":
-        json_bytes = json.dumps(obj, default=serialize_json).encode("utf-8")
-        with gzip.open(filepath, mode="w") as f:
-            f.write(json_bytes)
-    else:
-        with open(filepath, mode="w", encoding="utf8") as f:
-            json.dump(obj, f, default=serialize_json, indent=0)
+    Same columns as the full index made by ``experiments/indexing.py`` and
+    ``experiments/collect_json_actmeta.py``, but only for the given ids.
 
-    return True
+    ## Parameters
+    - act_dir (str): folder with .parquet and _meta.json files.
+    - act_ids (list[str])
 
+    ## Returns
+    - rows (pl.DataFrame)
+    """
+    points = scan_point_files([os.path.join(act_dir, a + ".parquet") for a in act_ids])
+    rows = index_points_lazy(points).collect()
+    rows = rows.join(point_file_stats(act_dir, act_ids), on="id", how="left")
+
+    metadata = [
+        pl.DataFrame([load_json(os.path.join(act_dir, a + "_meta.json"))])
+        for a in act_ids
+        if os.path.exists(os.path.join(act_dir, a + "_meta.json"))
+    ]
+    if metadata:
+        metadata = pl.concat(metadata, how="diagonal_relaxed")
+        rows = rows.join(metadata, on="id", how="left")
+    return rows
+
+
+def append_to_index(index_path: str, rows: pl.DataFrame):
+    """Add (or replace, by id) rows in the activity index.
+
+    The rows are saved as a new delta file next to the index file, so the
+    cost does not depend on the size of the index. Read the index with
+    ``load_index``, merge deltas into the index file with ``compact_index``.
+    """
+    folder = index_deltas_dir(index_path)
+    os.makedirs(folder, exist_ok=True)
+    # names sort by time, the random suffix avoids collisions on coarse clocks
+    name = f"{time.time_ns():020d}_{uuid.uuid4().hex[:8]}.parquet"
+    return safe_save(
+        rows,
+        os.path.join(folder, name),
+        overwrite=False,
+        check_read="footer",
+    )
 
-def load_json(filepath: str, enc="utf8") -> dict:
-    """Load..."""
-    # choose based on filetype
-    if filepath[-3:] == ".gz":
-        with gzip.open(filepath) as f:
-            return json.load(f)
-    else:
-        with open(filepath, encoding=enc) as f:
-            return json.load(f)
 
+def unindexed_ids(index_path: str, act_dir: str) -> list[str]:
+    """Ids of point files in act_dir that are not in the index (yet)."""
+    ids = point_file_stats(act_dir)["id"]
+    if os.path.exists(index_path) or index_deltas(index_path):
+        ids = ids.filter(~ids.is_in(load_index(index_path)["id"].implode()))
+    return ids.to_list()
 
-def save_settings(filepath: str, settings_dict: dict):
-    with open(filepath, "w") as f:
-        json.dump(settings_dict, f, indent=4)
 
+def missing_ids(index_path: str, act_dir: str) -> list[str]:
+    """Ids in the index whose point file is no longer in act_dir."""
+    if not (os.path.exists(index_path) or index_deltas(index_path)):
+        return []
+    ids = load_index(index_path)["id"]
+    return ids.filter(~ids.is_in(point_file_stats(act_dir)["id"].implode())).to_list()
 
-def load_all_gpx(folder: str, sample=0) -> list[gpxpy.gpx.GPX]:
-    """Load all gpx files in folder, using ``gpxpy``.
 
-    ## Parameters
-    - folder (str) - where to look for files.
-    - sample (int) - if positive, only load a random sample of files.
+def remove_from_index(index_path: str, act_ids: list[str]) -> int:
+    """Remove rows from the activity index, rewriting the index file.
 
     ## Returns
-    - activities (list) - list of gpxpy.gpx.GPX objects.
+    - n_removed (int)
     """
-    activities = []
-    filenames = glob("*.gpx", root_dir=folder)
+    deltas = index_deltas(index_path)
+    act_index = merge_index(index_path, deltas)
+    kept = act_index.filter(~pl.col("id").is_in(act_ids))
+    save_index(index_path, kept, deltas)
+    return len(act_index) - len(kept)
 
-    if sample > 0:
-        filenames = np.random.choice(filenames, sample)
 
-    for i, file in enumerate(filenames):
-        with open(os.path.join(folder, file), "r", encoding="utf8") as f:
-            gpx = gpxpy.parse(f, "lxml")
-        if gpx.tracks and gpx.tracks[0].segments and gpx.tracks[0].segments[0].points:
-            # add if not empty
-            activities.append(gpx)
+def index_deltas_dir(index_path: str) -> str:
+    """Folder of the delta files of an index, "<name>_deltas"."""
+    return os.path.splitext(index_path)[0] + "_deltas"
 
-    return activities
 
+def index_deltas(index_path: str) -> list[str]:
+    """Paths of the delta files of an index, oldest first."""
+    folder = index_deltas_dir(index_path)
+    if not os.path.isdir(folder):
+        return []
+    return [
+        os.path.join(folder, f)
+        for f in sorted(os.listdir(folder))
+        if f.endswith(".parquet")
+    ]
 
-def load_one_gpx(filepath: str):
-    with open(filepath, "r", encoding="utf8") as f:
-        gpx = gpxpy.parse(f, "lxml")
-    if gpx.tracks and gpx.tracks[0].segments and gpx.tracks[0].segments[0].points:
-        return gpx
 
+def index_mtime_ns(index_path: str) -> int:
+    """Last change of an index file or its deltas, to know when to reload.
 
-def load_fit(filepath: str):
-    """Load a .fit-file, or compressed .fit.gz-file.
+    0 if there is neither.
+    """
+    paths = [index_path, index_deltas_dir(index_path)]
+    return max((os.stat(p).st_mtime_ns for p in paths if os.path.exists(p)), default=0)
 
-    Extract point-wise data from data-message named "record".
 
-    ## Returns
-    - metadata (dict)
-    - points (dict)
-    """
+def index_derived_path(index_path: str, name: str) -> str:
+    """Path of a file derived from an index, "<index>_<name>.parquet"."""
+    return os.path.splitext(index_path)[0] + f"_{name}.parquet"
 
-    record_fields = {
-        "timestamp": "time",
-        "position_lat": "lat",
-        "position_long": "long",
-        "enhanced_speed": "speed_enh",
-        "enhanced_altitude": "alt_enh",
-        "heart_rate": "hr",
-    }
 
-    points = {k: [] for k in record_fields.values()}
-    metadata = {}
+def index_derived_fresh(path: str, index_path: str) -> bool:
+    """True if a derived file exists and is not older than the index."""
+    return os.path.exists(path) and os.stat(path).st_mtime_ns >= index_mtime_ns(
+        index_path
+    )
 
-    # choose based on filetype
-    if filepath[-3:] == ".gz":
-        openfunc = gzip.open
-    else:
-        openfunc = open
 
-    with openfunc(filepath, "rb") as f:
-        with fitdecode.FitReader(f, check_crc=fitdecode.CrcCheck.RAISE) as fit:
-            for frame in fit:
-                # frame with data?
-                if frame.frame_type == fitdecode.FIT_FRAME_DATA:
-                    if frame.name == "record":
-                        for k in record_fields.keys():
-                            points[record_fields[k]].append(
-                                frame.get_value(k, fallback=None)
-                            )
-                    elif frame.name == "sport":
-                        sport_name = frame.get_value("name")
-                        sport_main = frame.get_value("sport")
-                        metadata["sport_spec"] = sport_name
-                        metadata["sport_main"] = sport_main
+def merge_index(index_path: str, deltas: list[str]) -> pl.DataFrame:
+    """The index file with the rows of the deltas applied, last one wins."""
+    frames = [pl.read_parquet(p) for p in deltas]
+    if os.path.exists(index_path) or not frames:
+        frames.insert(0, pl.read_parquet(index_path))
+    if len(frames) == 1:
+        return frames[0]
+    return pl.concat(frames, how="diagonal_relaxed").unique(
+        "id", keep="last", maintain_order=True
+    )
 
-        return metadata, points
 
+def load_index(index_path: str, cols_required: set = None) -> pl.DataFrame:
+    """Load the activity index, with rows added by ``append_to_index``.
 
-def find_importable(folder: str, extensions=IMPORT_TYPES):
-    """Find all files that could be imported as activities."""
+    ## Parameters
+    - index_path (str)
+    - cols_required (set): Raise ValueError if column missing/of null type.
 
-    matches = []
-    for root, _, filenames in os.walk(folder):
-        for extension in extensions:
-            for filename in fnmatch.filter(filenames, f"*{extension}"):
-                name = filename.split(".")[0]
-                file_path = os.path.join(root, filename)
-                file_size = os.path.getsize(file_path)
-                matches.append((name, file_path, file_size, extension))
+    ## Returns
+    - act_index (pl.DataFrame)
+    """
+    act_index = merge_index(index_path, index_deltas(index_path))
+    for col in cols_required or ():
+        if col not in act_index.columns:
+            raise ValueError(f"missing column {col}")
+        if act_index.schema[col] == pl.Null:
+            raise ValueError(f"column {col} of Null type")
+    return act_index
 
-    if not matches:
-        return None
 
-    df = pl.DataFrame(matches)
-    df.columns = ["name", "path", "size", "type"]
-    return df.sort("name", "type")
+def save_index(index_path: str, act_index: pl.DataFrame, deltas: list[str]):
+    """Replace the whole activity index, and remove the deltas it includes.
 
+    ## Parameters
+    - index_path (str)
+    - act_index (pl.DataFrame)
+    - deltas (list[str]): ``index_deltas`` listed before the index was loaded
+        or built. Deltas added since are kept, as in ``compact_index``.
+    """
+    safe_save(act_index, index_path, check_read=True, fsync=True)
+    for path in deltas:
+        os.remove(path)
+    return True
 
-def convert_fit_polars(filepath):
-    """Load a fit file to a dict of metadata and a dataframe of points.
+
+def compact_index(index_path: str) -> int:
+    """Merge the deltas of an index into the index file.
+
+    Deltas added while compacting are kept. If interrupted, the deltas are
+    applied again, which gives the same index.
 
     ## Returns
-    - metadata (dict):
-    - points (pl.DataFrame):
+    - n_deltas (int): number of merged delta files.
     """
+    deltas = index_deltas(index_path)
+    if deltas:
+        act_index = merge_index(index_path, deltas)
+        safe_save(act_index, index_path, check_read="footer", fsync=True)
+        for path in deltas:
+            os.remove(path)
+    return len(deltas)
 
-    act_id = os.path.split(filepath)[-1].split(".")[0]
-    metadata, points = load_fit(filepath)
-    metadata["id"] = act_id
 
-    points = pl.DataFrame(points)
-    points = points.with_columns(points["hr"].cast(pl.UInt16))
-    return metadata, points
+class SpatialIndex:
+    """Grid index over activity bounding boxes, for region queries.
 
+    Each activity is listed in the grid cells (``SPATIAL_CELL_DEG``) that its
+    bounding box overlaps, as sorted cell keys. A query looks up the cells of
+    its region with ``np.searchsorted`` and checks the boxes of the activities
+    found, so its cost depends on the size of the region, not the number of
+    activities. Activities without position are not indexed.
 
-def convert_all_fit_polars(
-    folder_in: str, folder_out: str, overwrite=False, verbose=True
-):
-    files = find_importable(folder_in, extensions=[".fit", ".fit.gz"])["path"]
-    for i, fp in enumerate(files):
-        act_id = os.path.split(fp)[-1].split(".")[0]
-        path_out = os.path.join(folder_out, act_id + ".parquet")
+    Make one with ``SpatialIndex.from_index``, or use the one saved next to an
+    index file with ``SpatialIndex.for_index``. Query coordinates are degrees.
+
+    ## Parameters
+    - boxes (pl.DataFrame): id, min_lat, max_lat, min_long, max_long
+        (semicircles) and cells (list of cell keys, null when more than
+        ``SPATIAL_MAX_CELLS``), as made by ``from_index``.
+    """
+
+    N_ROWS = round(180 / SPATIAL_CELL_DEG)
+    N_COLS = round(360 / SPATIAL_CELL_DEG)
+
+    def __init__(self, boxes: pl.DataFrame) -> None:
+        self.boxes = boxes
+        self.ids = boxes["id"].to_numpy()
+        self.min_lat, self.max_lat, self.min_long, self.max_long = (
+            boxes[c].to_numpy().astype(np.float64) * (180 / 2**31)
+            for c in ("min_lat", "max_lat", "min_long", "max_long")
+        )
+
+        # cell key -> activity rows, sorted by key
+        cells = boxes["cells"]
+        n_cells = cells.list.len().fill_null(0).to_numpy()
+        keys = cells.explode().drop_nulls().to_numpy()
+        rows = np.repeat(np.arange(len(boxes)), n_cells)
+        order = np.argsort(keys, kind="stable")
+        self.cell_keys = keys[order]
+        self.cell_rows = rows[order]
+        self.large = np.flatnonzero(
+            cells.is_null().to_numpy() & boxes["min_lat"].is_not_null().to_numpy()
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"SpatialIndex({len(self.boxes)} activities, "
+            f"{len(self.cell_keys)} cell entries, {len(self.large)} large)"
+        )
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @classmethod
+    def cell(cls, lat, long):
+        """Grid row and column of coordinates (degrees)."""
+        row = np.clip(np.floor((lat + 90) / SPATIAL_CELL_DEG), 0, cls.N_ROWS - 1)
+        col = np.clip(np.floor((long + 180) / SPATIAL_CELL_DEG), 0, cls.N_COLS - 1)
+        return row.astype(np.int64), col.astype(np.int64)
+
+    @classmethod
+    def from_index(cls, act_index: pl.DataFrame) -> "SpatialIndex":
+        """Index the bounding boxes of an activity index (``index_points_lazy``)."""
+        boxes = act_index.select("id", "min_lat", "max_lat", "min_long", "max_long")
+        deg = boxes.select(pl.exclude("id").cast(pl.Float64) * (180 / 2**31))
+        valid = deg["min_lat"].is_not_null().to_numpy()
+        deg = deg.fill_null(0)
+        r0, c0 = cls.cell(deg["min_lat"].to_numpy(), deg["min_long"].to_numpy())
+        r1, c1 = cls.cell(deg["max_lat"].to_numpy(), deg["max_long"].to_numpy())
+        n_rows, n_cols = r1 - r0 + 1, c1 - c0 + 1
+        n_cells = np.where(valid, n_rows * n_cols, 0)
+        small = valid & (n_cells <= SPATIAL_MAX_CELLS)
+        n_cells[~small] = 0
+
+        # all (row, col) of each box, one key per cell
+        acts = np.repeat(np.arange(len(boxes)), n_cells)
+        offset = np.arange(n_cells.sum()) - np.repeat(
+            np.cumsum(n_cells) - n_cells, n_cells
+        )
+        keys = (
+            (r0[acts] + offset // n_cols[acts]) * cls.N_COLS
+            + c0[acts]
+            + offset % n_cols[acts]
+        )
+
+        cells = (
+            pl.DataFrame({"row": acts, "cells": keys})
+            .group_by("row", maintain_order=True)
+            .agg("cells")
+        )
+        boxes = (
+            boxes.with_row_index("row")
+            .join(cells, on="row", how="left", maintain_order="left")
+            .drop("row")
+        )
+        return cls(boxes)
+
+    @classmethod
+    def for_index(
+        cls, index_path: str, act_index: pl.DataFrame = None
+    ) -> "SpatialIndex":
+        """Spatial index saved next to an index file, rebuilt if out of date.
+
+        ## Parameters
+        - index_path (str)
+        - act_index (pl.DataFrame): the loaded index, else read with ``load_index``.
+        """
+        path = index_derived_path(index_path, "spatial")
+        if index_derived_fresh(path, index_path):
+            return cls(pl.read_parquet(path))
+
+        if act_index is None:
+            act_index = load_index(index_path)
+        spatial = cls.from_index(act_index)
+        safe_save(spatial.boxes, path, check_read="footer")
+        return spatial
+
+    def query_rows(self, min_lat, max_lat, min_long, max_long) -> np.ndarray:
+        """Rows of the activities whose box intersects a region, in index order."""
+        if min_long > max_long:
+            # region across the antimeridian
+            return np.union1d(
+                self.query_rows(min_lat, max_lat, min_long, 180),
+                self.query_rows(min_lat, max_lat, -180, max_long),
+            )
+
+        (r0, r1), (c0, c1) = self.cell(
+            np.array([min_lat, max_lat]), np.array([min_long, max_long])
+        )
+        row_keys = np.arange(r0, r1 + 1) * self.N_COLS
+        starts = np.searchsorted(self.cell_keys, row_keys + c0)
+        ends = np.searchsorted(self.cell_keys, row_keys + c1, side="right")
+        if (ends - starts).sum() > len(self.boxes):
+            # large region, checking all boxes is faster
+            candidates = np.arange(len(self.boxes))
+        else:
+            candidates = np.concatenate(
+                [self.cell_rows[a:b] for a, b in zip(starts, ends)] + [self.large]
+            )
+
+        hit = (
+            (self.min_lat[candidates] <= max_lat)
+            & (self.max_lat[candidates] >= min_lat)
+            & (self.min_long[candidates] <= max_long)
+            & (self.max_long[candidates] >= min_long)
+        )
+        # activities are in several cells, keep each once
+        found = np.zeros(len(self.boxes), dtype=bool)
+        found[candidates[hit]] = True
+        return np.flatnonzero(found)
+
+    def intersecting(self, min_lat, max_lat, min_long, max_long) -> list[str]:
+        """Ids of activities whose bounding box intersects a viewport (degrees).
+
+        A viewport with min_long > max_long crosses the antimeridian.
+        """
+        return self.ids[self.query_rows(min_lat, max_lat, min_long, max_long)].tolist()
+
+    def within(self, lat: float, long: float, radius_km: float) -> list[str]:
+        """Ids of activities within a distance of a point (degrees).
+
+        The distance is to the bounding box of the activity (small-angle
+        approximation), so the track itself may be farther away.
+        """
+        d_lat = radius_km / (6371 * pi / 180)
+        d_long = min(d_lat / max(np.cos(np.radians(lat)), 1e-9), 180)
+        min_long, max_long = long - d_long, long + d_long
+        rows = self.query_rows(
+            lat - d_lat,
+            lat + d_lat,
+            (min_long + 180) % 360 - 180 if d_long < 180 else -180,
+            (max_long + 180) % 360 - 180 if d_long < 180 else 180,
+        )
+
+        # nearest point of each box
+        near_lat = np.clip(lat, self.min_lat[rows], self.max_lat[rows])
+        min_long, max_long = self.min_long[rows], self.max_long[rows]
+        long = long - 360 * np.round((long - (min_long + max_long) / 2) / 360)
+        dx = long - np.clip(long, min_long, max_long)
+        dist = (
+            6371
+            * np.radians(1)
+            * np.hypot(near_lat - lat, dx * np.cos(np.radians((near_lat + lat) / 2)))
+        )
+        return self.ids[rows[dist <= radius_km]].tolist()
+
+
+def activity_regions(
+    act_index: pl.DataFrame,
+    by: Literal["start", "mid"] = "start",
+    cell_deg: float = REGION_CELL_DEG,
+    min_count: int = 1,
+) -> pl.DataFrame:
+    """Group activities into regions by their start or midpoint.
+
+    Positions are counted in grid cells of cell_deg. Cells with at least
+    min_count activities that touch (also diagonally) form a region. Regions
+    are found by propagating the smallest cell number over the neighbour
+    pairs, with numpy, so the cost is linear in the number of activities.
+
+    ## Parameters
+    - act_index (pl.DataFrame): with start_lat/start_long or mid_lat/mid_long.
+    - by (str): "start" or "mid" position.
+    - cell_deg (float): grid cell size (degrees).
+    - min_count (int): cells with fewer activities are left out.
+
+    ## Returns
+    - regions (pl.DataFrame): region (0 is the busiest), count, min_lat,
+        max_lat, min_long, max_long, lat, long (center, degrees), ids.
+    """
+    if by not in ("start", "mid"):
+        raise ValueError("by should be 'start' or 'mid'")
+    n_cols = round(360 / cell_deg)
+    pos = act_index.select(
+        "id",
+        lat=pl.col(f"{by}_lat").cast(pl.Float64) * (180 / 2**31),
+        long=pl.col(f"{by}_long").cast(pl.Float64) * (180 / 2**31),
+    ).drop_nulls()
+    pos = pos.with_columns(
+        key=((pl.col("lat") + 90) / cell_deg).floor().cast(pl.Int64) * n_cols
+        + ((pl.col("long") + 180) / cell_deg).floor().cast(pl.Int64)
+    )
+    cells = (
+        pos.group_by("key")
+        .agg(count=pl.len())
+        .filter(pl.col("count") >= min_count)
+        .sort("key")
+    )
+    keys = cells["key"].to_numpy()
+
+    # neighbour pairs: right, and the 3 cells above
+    u, v = [], []
+    for offset in (1, n_cols - 1, n_cols, n_cols + 1):
+        i = np.searchsorted(keys, keys + offset)
+        found = i < len(keys)
+        found[found] = keys[i[found]] == keys[found] + offset
+        u.append(np.flatnonzero(found))
+        v.append(i[found])
+    u, v = np.concatenate(u), np.concatenate(v)
+
+    # label of each cell: smallest cell number in its region
+    labels = np.arange(len(keys))
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, u, labels[v])
+        np.minimum.at(new, v, labels[u])
+        new = new[new]
+        if np.array_equal(new, labels):
+            break
+        labels = new
+
+    cell_labels = pl.DataFrame({"key": keys, "label": labels})
+    regions = (
+        pos.join(cell_labels, on="key")
+        .group_by("label")
+        .agg(
+            count=pl.len(),
+            min_lat=pl.col("lat").min(),
+            max_lat=pl.col("lat").max(),
+            min_long=pl.col("long").min(),
+            max_long=pl.col("long").max(),
+            lat=pl.col("lat").mean(),
+            long=pl.col("long").mean(),
+            ids=pl.col("id"),
+        )
+        .sort("count", "label", descending=[True, False])
+        .drop("label")
+    )
+    return regions.with_row_index("region")
+
+
+def load_regions(
+    index_path: str,
+    act_index: pl.DataFrame = None,
+    by: Literal["start", "mid"] = "start",
+) -> pl.DataFrame:
+    """Regions of an index (``activity_regions``), saved next to the index
+    file and made again when the index changed.
+
+    ## Parameters
+    - index_path (str)
+    - act_index (pl.DataFrame): the loaded index, else read with ``load_index``.
+    - by (str): "start" or "mid" position.
+    """
+    path = index_derived_path(index_path, f"regions_{by}")
+    if index_derived_fresh(path, index_path):
+        return pl.read_parquet(path)
+
+    if act_index is None:
+        act_index = load_index(index_path)
+    regions = activity_regions(act_index, by)
+    safe_save(regions, path, check_read="footer")
+    return regions
+
+
+def mercator_pixels(lat, long, zoom: int) -> tuple[np.ndarray, np.ndarray]:
+    """Global pixel coordinates of points in web mercator map tiles.
+
+    ## Parameters
+    - lat, long (np.ndarray): semicircles.
+    - zoom (int): tile zoom level, 2**zoom tiles of ``HEATMAP_TILE_SIZE``
+        pixels in each direction.
+
+    ## Returns
+    - x, y (np.ndarray): pixel column and row (int64), 0 at the top left.
+    """
+    n_pixels = HEATMAP_TILE_SIZE * 2**zoom
+    lat = np.radians(np.clip(np.asarray(lat) * (180 / 2**31), -85.0511, 85.0511))
+    x = (np.asarray(long) * (180 / 2**31) + 180) / 360 * n_pixels
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / pi) / 2 * n_pixels
+    return (
+        np.clip(x, 0, n_pixels - 1).astype(np.int64),
+        np.clip(y, 0, n_pixels - 1).astype(np.int64),
+    )
+
+
+class HeatmapTiles:
+    """Heatmap of all activities as a pyramid of raster tiles.
+
+    Tiles of ``HEATMAP_TILE_SIZE`` pixels (web mercator z/x/y, as map
+    tiles) count the activities through each pixel at max_zoom, an activity
+    counts once per pixel. Points are only binned at max_zoom, a pixel of a
+    lower zoom is the sum of the 2x2 pixels below it in its child tiles. Tiles with
+    counts are saved as "<tile_dir>/<z>/<x>/<y>.npz".
+
+    ``update`` compares the index with the activities in the tiles (saved in
+    "manifest.parquet"): new activities are added to the tiles they touch,
+    tiles touched by removed or changed activities are binned again. Only
+    changed tiles and their parents are saved.
+
+    ## Parameters
+    - tile_dir (str): folder of the tiles, created when tiles are saved.
+    - max_zoom (int): zoom level where points are binned.
+    """
+
+    MANIFEST_SCHEMA = {
+        "id": pl.String,
+        "file_mtime_ns": pl.Int64,
+        "min_lat": pl.Int64,
+        "max_lat": pl.Int64,
+        "min_long": pl.Int64,
+        "max_long": pl.Int64,
+    }
+
+    def __init__(self, tile_dir: str, max_zoom=HEATMAP_MAX_ZOOM) -> None:
+        self.tile_dir = tile_dir
+        self.max_zoom = max_zoom
+
+    def __repr__(self) -> str:
+        return f"HeatmapTiles({self.tile_dir!r}, max_zoom={self.max_zoom})"
+
+    def tile_path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self.tile_dir, str(z), str(x), f"{y}.npz")
+
+    def counts(self, z: int, x: int, y: int) -> np.ndarray:
+        """Counts of a tile (uint32, rows top to bottom), None if empty."""
+        path = self.tile_path(z, x, y)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data["arr_0"]
+
+    def save_tile(self, z: int, x: int, y: int, counts: np.ndarray):
+        """Save a tile, or remove it if it has no counts."""
+        path = self.tile_path(z, x, y)
+        if counts.any():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            safe_save(counts, path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def manifest(self) -> pl.DataFrame:
+        """Activities in the tiles, with their file version and bounding box."""
+        path = os.path.join(self.tile_dir, "manifest.parquet")
+        if not os.path.exists(path):
+            return pl.DataFrame(schema=self.MANIFEST_SCHEMA)
+        return pl.read_parquet(path)
+
+    def box_tile_ranges(self, boxes: pl.DataFrame) -> tuple[np.ndarray, ...]:
+        """First and last tile column and row at max_zoom of bounding boxes
+        (semicircles), -1 where a box is missing."""
+        boxes = boxes.select(
+            pl.col("min_lat", "max_lat", "min_long", "max_long").fill_null(0),
+            valid=pl.col("min_lat").is_not_null(),
+        )
+        x0, y0 = mercator_pixels(boxes["max_lat"], boxes["min_long"], self.max_zoom)
+        x1, y1 = mercator_pixels(boxes["min_lat"], boxes["max_long"], self.max_zoom)
+        valid = boxes["valid"].to_numpy()
+        return tuple(
+            np.where(valid, v // HEATMAP_TILE_SIZE, -1) for v in (x0, x1, y0, y1)
+        )
+
+    def box_tiles(self, boxes: pl.DataFrame) -> set[tuple[int, int]]:
+        """Tiles at max_zoom that bounding boxes (semicircles) overlap."""
+        tiles = set()
+        for a, b, c, d in zip(*self.box_tile_ranges(boxes)):
+            tiles.update((x, y) for x in range(a, b + 1) for y in range(c, d + 1))
+        return tiles
+
+    def update(self, act_index: pl.DataFrame, act_dir: str, verbose=False) -> int:
+        """Bring the tiles up to date with an activity index.
+
+        ## Parameters
+        - act_index (pl.DataFrame): with bounding box columns (``build_index``).
+        - act_dir (str): folder with the .parquet point files.
+        - verbose (bool)
+
+        ## Returns
+        - n_tiles (int): number of tiles saved or removed, all zoom levels.
+        """
+        current = act_index.select(
+            "id",
+            (
+                pl.col("file_mtime_ns").fill_null(0)
+                if "file_mtime_ns" in act_index.columns
+                else pl.lit(0, pl.Int64).alias("file_mtime_ns")
+            ),
+            "min_lat",
+            "max_lat",
+            "min_long",
+            "max_long",
+        ).cast(self.MANIFEST_SCHEMA)
+        old = self.manifest()
+        added = current.join(old, on="id", how="anti")
+        # removed, and old and new version of changed activities
+        gone = old.join(current, on=["id", "file_mtime_ns"], how="anti")
+        changed = current.join(gone, on="id", how="semi")
+
+        # tiles binned again, from all activities that overlap them
+        dirty = self.box_tiles(pl.concat([gone, changed]))
+        in_dirty = []
+        if dirty:
+            dirty_x, dirty_y = np.array(list(dirty)).T
+            x0, x1, y0, y1 = self.box_tile_ranges(current)
+            # boxes near the dirty tiles, then tile by tile
+            near = (
+                (x0 >= 0)
+                & (x0 <= dirty_x.max())
+                & (x1 >= dirty_x.min())
+                & (y0 <= dirty_y.max())
+                & (y1 >= dirty_y.min())
+            )
+            for i in np.flatnonzero(near):
+                if any(
+                    (x, y) in dirty
+                    for x in range(x0[i], x1[i] + 1)
+                    for y in range(y0[i], y1[i] + 1)
+                ):
+                    in_dirty.append(current[int(i), "id"])
+        to_load = set(added["id"]) | set(in_dirty)
+        if not to_load and len(gone) == 0:
+            return 0
+        if verbose:
+            print(
+                f"{len(added)} added, {len(gone)} removed/changed activities, "
+                f"{len(dirty)} tiles to bin again, {len(to_load)} files to load"
+            )
+
+        # pixel keys (tile << 16 | pixel) at max zoom, each activity once
+        added_ids = set(added["id"])
+        keys = []
+        size = HEATMAP_TILE_SIZE
+        n_tiles = 2**self.max_zoom
+        dirty_keys = np.array([x * n_tiles + y for x, y in dirty], dtype=np.int64)
+        for act_id in to_load:
+            try:
+                points = load_parquet(
+                    os.path.join(act_dir, act_id + ".parquet"),
+                    cols_required={"lat", "long"},
+                    columns=["lat", "long"],
+                ).drop_nulls()
+            except (ValueError, OSError):
+                continue
+            x, y = mercator_pixels(points["lat"], points["long"], self.max_zoom)
+            tile = (x // size) * n_tiles + y // size
+            key = np.unique((tile << 16) | ((y % size) * size + x % size))
+            if act_id not in added_ids:
+                # activity already in the other tiles
+                key = key[np.isin(key >> 16, dirty_keys)]
+            keys.append(key)
+
+        keys = np.sort(np.concatenate(keys)) if keys else np.zeros(0, np.int64)
+        tiles = keys >> 16
+        starts = np.flatnonzero(np.diff(tiles, prepend=-1))
+        ends = np.append(starts[1:], len(keys))
+
+        touched = set(dirty)
+        counts = {tile: np.zeros(size * size, np.uint32) for tile in dirty}
+        for a, b in zip(starts, ends):
+            tile = (int(tiles[a] // n_tiles), int(tiles[a] % n_tiles))
+            if tile not in counts:
+                old_counts = self.counts(self.max_zoom, *tile)
+                counts[tile] = (
+                    old_counts.ravel()
+                    if old_counts is not None
+                    else np.zeros(size * size, np.uint32)
+                )
+            counts[tile] += np.bincount(
+                keys[a:b] & 0xFFFF, minlength=size * size
+            ).astype(np.uint32)
+            touched.add(tile)
+        for (x, y), c in counts.items():
+            self.save_tile(self.max_zoom, x, y, c.reshape(size, size))
+
+        n_saved = len(touched)
+        for z in range(self.max_zoom - 1, -1, -1):
+            touched = {(x // 2, y // 2) for x, y in touched}
+            for x, y in touched:
+                self.save_tile(z, x, y, self.merge_children(z, x, y))
+            n_saved += len(touched)
+
+        os.makedirs(self.tile_dir, exist_ok=True)
+        safe_save(
+            current,
+            os.path.join(self.tile_dir, "manifest.parquet"),
+            check_read="footer",
+        )
+        return n_saved
+
+    def merge_children(self, z: int, x: int, y: int) -> np.ndarray:
+        """Counts of a tile, from its 4 tiles at zoom z + 1."""
+        half = HEATMAP_TILE_SIZE // 2
+        counts = np.zeros((HEATMAP_TILE_SIZE, HEATMAP_TILE_SIZE), np.uint32)
+        for dx in (0, 1):
+            for dy in (0, 1):
+                child = self.counts(z + 1, 2 * x + dx, 2 * y + dy)
+                if child is not None:
+                    counts[dy * half : (dy + 1) * half, dx * half : (dx + 1) * half] = (
+                        child.reshape(half, 2, half, 2).sum(axis=(1, 3))
+                    )
+        return counts
+
+
+def segment_key(segment, tolerance_m: float = SEGMENT_TOLERANCE_M) -> str:
+    """Short hash of a segment and tolerance, to name its cache file.
+
+    Includes ``SEGMENT_MATCH_VERSION``, so that efforts found by an older
+    matching are not reused.
+    """
+    segment = np.ascontiguousarray(segment, dtype=np.float64)
+    return hashlib.blake2b(
+        segment.tobytes()
+        + np.float64(tolerance_m).tobytes()
+        + np.int64(SEGMENT_MATCH_VERSION).tobytes(),
+        digest_size=8,
+    ).hexdigest()
+
+
+def segment_efforts(
+    segment,
+    act_index: pl.DataFrame,
+    act_dir: str,
+    spatial: SpatialIndex = None,
+    cache_dir: str = None,
+    tolerance_m: float = SEGMENT_TOLERANCE_M,
+    verbose=False,
+) -> pl.DataFrame:
+    """Find every effort of the activities on a segment.
+
+    Only activities whose bounding box is near both the start and the end of
+    the segment are loaded (``SpatialIndex.within``), and matched with
+    ``statsf.segment_crossings``.
+
+    With a cache_dir, the activities checked are saved per segment
+    ("segment_<key>.parquet"), with the modification time of their point
+    file. Calling again with an updated index only loads new or changed
+    activities.
+
+    ## Parameters
+    - segment: polyline as (lat, long) pairs in degrees.
+    - act_index (pl.DataFrame): with bounding box columns (``build_index``).
+    - act_dir (str): folder with the .parquet point files.
+    - spatial (SpatialIndex): of act_index, made if None.
+    - cache_dir (str): folder for the cached efforts, no cache if None.
+    - tolerance_m (float): see ``statsf.segment_crossings``.
+    - verbose (bool)
+
+    ## Returns
+    - efforts (pl.DataFrame): id, start_time, end_time, elapsed; fastest first.
+    """
+    segment = np.asarray(segment, dtype=np.float64)
+    if spatial is None:
+        spatial = SpatialIndex.from_index(act_index)
+
+    radius_km = tolerance_m / 1000
+    candidates = set(spatial.within(*segment[0], radius_km)) & set(
+        spatial.within(*segment[-1], radius_km)
+    )
+
+    # activities and point file version
+    if "file_mtime_ns" in act_index.columns:
+        versions = act_index.select("id", pl.col("file_mtime_ns").fill_null(0))
+    else:
+        versions = act_index.select("id", file_mtime_ns=pl.lit(0, pl.Int64))
+
+    cache_path = None
+    checked = pl.DataFrame(schema=SEGMENT_EFFORTS_SCHEMA)
+    stale = False
+    if cache_dir is not None:
+        cache_path = os.path.join(
+            cache_dir, f"segment_{segment_key(segment, tolerance_m)}.parquet"
+        )
+        if os.path.exists(cache_path):
+            # removed and changed activities are checked again
+            cached = pl.read_parquet(cache_path)
+            checked = cached.join(versions, on=["id", "file_mtime_ns"], how="semi")
+            stale = len(checked) < len(cached)
+
+    todo = versions.filter(
+        pl.col("id").is_in(list(candidates))
+        & ~pl.col("id").is_in(checked["id"].implode())
+    )
+    if verbose:
+        print(f"{len(candidates)} candidates, {len(todo)} to check")
+
+    rows = []
+    for act_id, mtime in todo.iter_rows():
+        try:
+            points = load_parquet(
+                os.path.join(act_dir, act_id + ".parquet"),
+                cols_required={"time", "lat", "long"},
+                columns=["time", "lat", "long"],
+            )
+        except (ValueError, OSError):
+            points = None
+        crossings = []
+        if points is not None:
+            crossings = statsf.segment_crossings(
+                points["lat"].to_numpy(),
+                points["long"].to_numpy(),
+                segment,
+                tolerance_m,
+            )
+        if not crossings:
+            # checked, no effort
+            rows.append((act_id, mtime, None, None, None))
+        times = points["time"] if crossings else None
+        for entry, exit in crossings:
+            start, end = times[entry], times[exit]
+            rows.append((act_id, mtime, start, end, end - start))
+
+    checked = pl.concat(
+        [checked, pl.DataFrame(rows, schema=SEGMENT_EFFORTS_SCHEMA, orient="row")]
+    )
+    if cache_path is not None and (rows or stale):
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_save(checked, cache_path, check_read="footer")
+
+    return (
+        checked.filter(pl.col("elapsed").is_not_null())
+        .drop("file_mtime_ns")
+        .sort("elapsed", "start_time")
+    )
+
+
+def watch_folder(
+    folder_in: str,
+    folder_out: str,
+    index_path: str,
+    manifest_path: str,
+    interval=2.0,
+    debounce=2.0,
+    workers=1,
+    max_polls: int = None,
+    verbose=True,
+    compact_after=16,
+    heatmap_dir: str = None,
+):
+    """Poll a folder and import new or changed activities as they arrive.
+
+    Listing the folder (``scan_sources``) is cheap, so it is polled every
+    ``interval`` seconds. When the listing changes, ingestion waits until it
+    has been stable for ``debounce`` seconds, so that a burst of files, or a
+    file still being written, is handled as one batch. The batch is converted
+    with ``convert_all_polars`` (using the import manifest) and only the new
+    rows are added to the index. Activities of deleted files are removed from
+    the index. The first poll catches up on anything that arrived while not
+    watching. A poll that fails is reported and the watch goes on, files
+    that can not be converted are skipped (see ``convert_all_polars``).
+
+    ## Parameters
+    - folder_in (str): activities folder to watch.
+    - folder_out (str): destination of converted activities.
+    - index_path (str): activity index (.parquet).
+    - manifest_path (str): import manifest (.parquet).
+    - interval (float): seconds between polls.
+    - debounce (float): seconds without changes before importing.
+    - workers (int): processes for conversion.
+    - max_polls (int): stop after this many polls, default never.
+    - verbose (bool): print progress.
+    - compact_after (int): when nothing is being imported and the index
+        has this many delta files, merge them (``compact_index``).
+    - heatmap_dir (str): if given, heatmap tiles (``HeatmapTiles``) updated
+        after each batch.
+    """
+    last = None
+    changed_at = None
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        try:
+            snapshot = scan_sources(folder_in, CONVERT_TYPES).sort("path")
+            if last is None or not snapshot.equals(last):
+                last, changed_at = snapshot, time.monotonic()
+
+            if changed_at is not None and time.monotonic() - changed_at >= debounce:
+                converted = convert_all_polars(
+                    folder_in,
+                    folder_out,
+                    verbose=verbose,
+                    workers=workers,
+                    manifest_path=manifest_path,
+                )
+                # also outputs of a batch that stopped before indexing
+                converted = list(
+                    dict.fromkeys(converted + unindexed_ids(index_path, folder_out))
+                )
+                if converted:
+                    append_to_index(
+                        index_path, index_activity_files(folder_out, converted)
+                    )
+                    if verbose:
+                        print(f"indexed {len(converted)} new activities")
+                # outputs of deleted sources, removed by convert_all_polars
+                removed = missing_ids(index_path, folder_out)
+                if removed:
+                    n = remove_from_index(index_path, removed)
+                    if verbose:
+                        print(f"removed {n} deleted activities from the index")
+                if heatmap_dir is not None and index_mtime_ns(index_path):
+                    n = HeatmapTiles(heatmap_dir).update(
+                        load_index(index_path), folder_out, verbose
+                    )
+                    if verbose and n:
+                        print(f"updated {n} heatmap tiles")
+                changed_at = None
+            elif changed_at is None and len(index_deltas(index_path)) >= compact_after:
+                n = compact_index(index_path)
+                if verbose:
+                    print(f"compacted {n} index deltas")
+        except Exception as e:
+            # keep watching, the batch is tried again at the next poll
+            print(f"watch poll failed: {e!r}")
+
+        polls += 1
+        time.sleep(interval)
+
+
+def info_from_gpx_track(track) -> dict[str]:
+    """Extract common metadata from a gpx_track"""
+    act_info = dict()
+    act_info["name"] = track.name
+    act_info["desc"] = track.description
+    act_info["comment"] = track.comment
+    act_info["type"] = track.type
+    act_info["source"] = track.source
+    act_info["n_points"] = len(track.segments[0].points)
+    act_info["length2d_m"] = track.length_2d()  # lat,long-length [m]
+    act_info["length3d_m"] = track.length_3d()  # lat,long,elev-length [m]
+
+    act_info["time_start"] = track.get_time_bounds().start_time
+    act_info["time_end"] = track.get_time_bounds().end_time
+    return act_info
+
+
+def info_from_gpx_points(metadata: dict, points: pl.DataFrame) -> dict[str]:
+    """Index entry from ``load_gpx_polars`` output, as ``info_from_gpx_track``."""
+    act_info = dict(metadata)
+    act_info["n_points"] = len(points)
+
+    # lat,long-length and lat,long,elev-length [m]
+    step_2d = statsf.trace_distance(points, "small-angle")["dist"].diff().fill_null(0)
+    step_z = points["alt_enh"].diff().fill_null(0)
+    act_info["length2d_m"] = step_2d.sum()
+    act_info["length3d_m"] = (step_2d.pow(2) + step_z.pow(2)).sqrt().sum()
+
+    act_info["time_start"] = pd.Timestamp(points["time"].min())
+    act_info["time_end"] = pd.Timestamp(points["time"].max())
+    return act_info
+
+
+def check_index(act_index: dict):
+    """Check index for duplicates and more"""
+
+    info = []
+
+    info.append("index created : %s" % act_index["created"])
+    info.append("index updated : %s" % act_index["updated"])
+    info.append("since update  : %s" % (pd.Timestamp.now() - act_index["updated"]))
+
+    acts = act_index["activities"]
+    duplicates = find_duplicates(acts)
+
+    info.append("activity count: %s" % len(acts))
+    info.append("found duplicates :%s" % len(duplicates))
+
+    return info
+
+
+def find_duplicates(acts: dict):
+    """Find pairs of identical index entries.
+
+    Entries are bucketed by a hash of their content (``hashable_entry``), so
+    only entries in the same bucket are compared, with ``==``.
+
+    ## Returns
+    - duplicates (list[tuple]): pairs of names, in index order.
+    """
+    buckets = {}
+    for i, act in enumerate(acts.values()):
+        buckets.setdefault(hashable_entry(act), []).append(i)
+
+    act_list = list(acts.values())
+    names_list = list(acts.keys())
+    matches = []
+    for idx in buckets.values():
+        for k, i in enumerate(idx[:-1]):
+            for j in idx[k + 1 :]:
+                if act_list[i] == act_list[j]:
+                    matches.append((i, j))
+    matches.sort()
+    return [(names_list[i], names_list[j]) for i, j in matches]
+
+
+def hashable_entry(obj):
+    """Hashable form of an index entry, equal for entries that are ``==``.
+
+    Dicts and lists become tuples, python's hash already matches ``==`` for
+    1 and 1.0 or a datetime and the same pd.Timestamp. Unhashable values
+    (e.g. a pd.DataFrame) are replaced by their type name, entries that only
+    differ there share a bucket and are told apart by ``==``.
+    """
+    if isinstance(obj, dict):
+        return tuple(
+            sorted(
+                ((k, hashable_entry(v)) for k, v in obj.items()),
+                key=lambda kv: str(kv[0]),
+            )
+        )
+    if isinstance(obj, (list, tuple)):
+        return tuple(hashable_entry(v) for v in obj)
+    try:
+        hash(obj)
+    except TypeError:
+        return type(obj).__name__
+    return obj
+
+
+def find_duplicates_polars(
+    act_index: pl.DataFrame,
+    act_dir: str = None,
+    time_tol_s=120,
+    dist_tol_m=500,
+    track_tol_m=50,
+    manifest_path: str = None,
+) -> pl.DataFrame:
+    """Find activities that are probably the same recording, e.g. one ride
+    imported both from a fit and a gpx file.
+
+    Candidates have close start time, duration and position (start/end if in
+    the index, else midpoint). They are found by bucketing on a coarse
+    fingerprint and joining each bucket with its neighbours, which is close to
+    linear in the number of activities. If ``act_dir`` is given, candidates are
+    confirmed by comparing their tracks at common times (``track_distance``).
+
+    ## Parameters
+    - act_index (pl.DataFrame): with id, n_points, start_time, duration and
+        mid_lat/mid_long or start_lat/start_long/end_lat/end_long (semicircles).
+    - act_dir (str): folder with activity parquet files.
+    - time_tol_s (float): max difference in start time and duration.
+    - dist_tol_m (float): max distance between positions.
+    - track_tol_m (float): max mean distance between tracks.
+    - manifest_path (str): import manifest, to report the source files.
+
+    ## Returns
+    - duplicates (pl.DataFrame): one row per pair, with id_keep (more points,
+        then first id), id_drop, start and position differences,
+        track_dist_m if confirmed from files, and source_keep/source_drop
+        (path in the import folder, null if unknown) with a manifest.
+    """
+    if {"start_lat", "start_long", "end_lat", "end_long"}.issubset(act_index.columns):
+        pos_cols = ["start_lat", "start_long", "end_lat", "end_long"]
+    else:
+        pos_cols = ["mid_lat", "mid_long"]
+
+    m_per_sc = 6371000 * pi / 2**31  # meters per semicircle (latitude)
+    pos_bucket = dist_tol_m / m_per_sc
+
+    acts = act_index.select(
+        "id",
+        "n_points",
+        pl.col("start_time").dt.epoch("s").alias("start_s"),
+        pl.col("duration").dt.total_seconds().alias("dur_s"),
+        *pos_cols,
+    ).drop_nulls()
+    acts = acts.with_columns(
+        (pl.col("start_s") // time_tol_s).alias("b_start"),
+        (pl.col(pos_cols[0]) // pos_bucket).alias("b_lat"),
+    )
+
+    # each activity also joins the neighbouring buckets, to not miss pairs
+    # on both sides of a bucket border
+    offsets = pl.DataFrame({"o_start": [-1, 0, 1]}).join(
+        pl.DataFrame({"o_lat": [-1, 0, 1]}), how="cross"
+    )
+    neighbours = (
+        acts.join(offsets, how="cross")
+        .with_columns(
+            pl.col("b_start") + pl.col("o_start"), pl.col("b_lat") + pl.col("o_lat")
+        )
+        .drop("o_start", "o_lat")
+    )
+
+    pairs = (
+        acts.join(neighbours, on=["b_start", "b_lat"], suffix="_2")
+        .filter(pl.col("id") < pl.col("id_2"))
+        .with_columns(
+            (pl.col("start_s") - pl.col("start_s_2")).abs().alias("d_start_s"),
+            (pl.col("dur_s") - pl.col("dur_s_2")).abs().alias("d_dur_s"),
+            pl.max_horizontal(
+                *[(pl.col(c) - pl.col(c + "_2")).abs() * m_per_sc for c in pos_cols]
+            ).alias("d_pos_m"),
+        )
+        .filter(
+            (pl.col("d_start_s") <= time_tol_s)
+            & (pl.col("d_dur_s") <= time_tol_s)
+            & (pl.col("d_pos_m") <= dist_tol_m)
+        )
+    )
+
+    keep_first = (pl.col("n_points") > pl.col("n_points_2")) | (
+        (pl.col("n_points") == pl.col("n_points_2")) & (pl.col("id") < pl.col("id_2"))
+    )
+    pairs = pairs.select(
+        pl.when(keep_first).then("id").otherwise("id_2").alias("id_keep"),
+        pl.when(keep_first).then("id_2").otherwise("id").alias("id_drop"),
+        "d_start_s",
+        "d_pos_m",
+    ).sort("id_keep", "id_drop")
+
+    if act_dir is not None:
+        pairs = confirm_duplicates(pairs, act_dir, track_tol_m)
+    if manifest_path is not None:
+        sources = (
+            load_manifest(manifest_path)
+            .explode("outputs")
+            .filter(pl.col("outputs").str.ends_with(".parquet"))
+            .select(id=pl.col("outputs").str.strip_suffix(".parquet"), source="path")
+            .unique("id", keep="first", maintain_order=True)
+        )
+        for col in ("keep", "drop"):
+            pairs = pairs.join(
+                sources.rename({"id": f"id_{col}", "source": f"source_{col}"}),
+                on=f"id_{col}",
+                how="left",
+                maintain_order="left",
+            )
+    return pairs
+
+
+def confirm_duplicates(
+    pairs: pl.DataFrame, act_dir: str, track_tol_m=50
+) -> pl.DataFrame:
+    """Keep pairs of ``find_duplicates_polars`` whose tracks are close, and
+    add their distance as track_dist_m."""
+    dists = []
+    for id_keep, id_drop in pairs.select("id_keep", "id_drop").rows():
+        tracks = [
+            load_parquet(
+                os.path.join(act_dir, a + ".parquet"),
+                cols_required={"time", "lat", "long"},
+            )
+            for a in (id_keep, id_drop)
+        ]
+        dists.append(track_distance(*tracks))
+    return pairs.with_columns(
+        pl.Series("track_dist_m", dists, dtype=pl.Float64)
+    ).filter(pl.col("track_dist_m") <= track_tol_m)
+
+
+def track_distance(points1: pl.DataFrame, points2: pl.DataFrame, n=32) -> float:
+    """Mean distance (m) between two tracks, compared at n common times.
+
+    Positions are linearly interpolated in time. Returns inf if the tracks do
+    not overlap in time.
+    """
+    tracks = []
+    for p in (points1, points2):
+        p = p.select("time", "lat", "long").drop_nulls()
+        tracks.append(
+            (
+                p["time"].dt.epoch("ms").to_numpy().astype(np.float64),
+                p["lat"].to_numpy().astype(np.float64),
+                p["long"].to_numpy().astype(np.float64),
+            )
+        )
+    (t1, lat1, lon1), (t2, lat2, lon2) = tracks
+    if not (len(t1) and len(t2)) or max(t1[0], t2[0]) >= min(t1[-1], t2[-1]):
+        return float("inf")
+
+    t = np.linspace(max(t1[0], t2[0]), min(t1[-1], t2[-1]), n)
+    dlat = np.interp(t, t1, lat1) - np.interp(t, t2, lat2)
+    dlon = np.interp(t, t1, lon1) - np.interp(t, t2, lon2)
+    lat_rad = np.interp(t, t1, lat1) * pi / 2**31
+    m_per_sc = 6371000 * pi / 2**31
+    return float(np.mean(np.hypot(dlat, dlon * np.cos(lat_rad))) * m_per_sc)
+
+
+def serialize_json(obj):
+    """Create resonable serializations for datatypes used here."""
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict(orient="dict")
+    raise TypeError("cannot serialize object (%s)" % type(obj))
+
+
+def load_act_index(filepath) -> dict:
+    """Load activity index from JSON.
+
+    ## Returns
+    - act_index (dict): with keys 'activities', 'updated' and 'created'.
+        - 'activities' is a list of dicts with keys 'name'...
+    """
+    with open(filepath, encoding="utf8") as f:
+        act_index = json.load(f)
+
+    # convert to datetime
+    act_index["updated"] = pd.Timestamp(act_index["updated"])
+    act_index["created"] = pd.Timestamp(act_index["created"])
+
+    for k in act_index["activities"].keys():
+        act_index["activities"][k]["time_start"] = pd.Timestamp(
+            act_index["activities"][k]["time_start"]
+        )
+        act_index["activities"][k]["time_end"] = pd.Timestamp(
+            act_index["activities"][k]["time_end"]
+        )
+    return act_index
+
+
+def load_parquet(
+    filepath: str,
+    cols_required: set = None,
+    columns: list[str] = None,
+    time_range: tuple = None,
+    n_rows: int = None,
+):
+    """Load a parquet file, optionally only some columns and rows.
+
+    The schema is checked from the file footer, without reading data. Column
+    selection, time range and row limit are pushed into the parquet scan, so
+    only the needed column chunks are read, and row groups outside the time
+    range are skipped using their statistics.
+
+    Compact point files (see ``encode_compact``) are decoded, with columns as
+    ``COMPACT_SCHEMA``.
+
+    ## Parameters
+    - filepath (str)
+    - cols_required (set): Raise ValueError if column missing/of null type.
+    - columns (list[str]): columns to load, default all. Raise ValueError if
+        missing.
+    - time_range (tuple): (start, end) datetimes, end excluded, either can be
+        None. Keeps rows with "time" in range. Naive datetimes are taken as UTC.
+    - n_rows (int): max number of rows to load (after the time filter).
+
+    ## Returns
+    - Dataframe (pl.DataFrame)
+    """
+    schema = pl.read_parquet_schema(filepath)
+    if is_compact(schema):
+        load = load_compact
+    else:
+        load = None
+    if cols_required or columns:
+        for col in cols_required or ():
+            if col not in schema:
+                raise ValueError(f"missing column {col}")
+            if schema[col] == pl.Null:
+                raise ValueError(f"column {col} of Null type")
+        for col in columns or ():
+            if col not in schema:
+                raise ValueError(f"missing column {col}")
+
+    if load is not None:
+        return load(filepath, columns, time_range, n_rows)
+    if columns is None and time_range is None and n_rows is None:
+        return pl.read_parquet(filepath)
+
+    lazy = pl.scan_parquet(filepath)
+    if time_range is not None:
+        lazy = lazy.filter(time_filter(*time_range))
+    if columns is not None:
+        lazy = lazy.select(columns)
+    if n_rows is not None:
+        lazy = lazy.head(n_rows)
+    return lazy.collect()
+
+
+class ActivityCache:
+    """Cache of activity points as uncompressed Arrow IPC files.
+
+    Reading an IPC file is mostly memory-mapping it, while a parquet file has
+    to be decompressed and decoded. Cached files are named by source id,
+    modification time and size, so a changed source is a miss, and the cache
+    survives restarts. Least recently used files are removed when the total
+    size is over budget.
+
+    ## Parameters
+    - cache_dir (str): folder for the cache files, created if missing.
+    - max_bytes (int): size budget of the cache files.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes=500_000_000) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # file name: size, oldest use first
+        self.files = OrderedDict()
+        entries = [e for e in os.scandir(cache_dir) if e.name.endswith(".arrow")]
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime_ns):
+            self.files[entry.name] = entry.stat().st_size
+        self.evict()
+
+    def __repr__(self) -> str:
+        return (
+            f"ActivityCache({len(self.files)} files, {self.size()} bytes, "
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions)"
+        )
+
+    def size(self) -> int:
+        """Total size of the cache files (bytes)."""
+        return sum(self.files.values())
+
+    def stats(self) -> dict[str, int]:
+        """Hit, miss and eviction counts, number of files and size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "files": len(self.files),
+            "bytes": self.size(),
+        }
+
+    def load(self, filepath: str, columns: list[str] = None) -> pl.DataFrame:
+        """Load activity points, from the cache if the source is unchanged.
+
+        ## Parameters
+        - filepath (str): source parquet file, see ``load_parquet``.
+        - columns (list[str]): columns to load, default all.
+
+        ## Returns
+        - points (pl.DataFrame)
+        """
+        stat = os.stat(filepath)
+        act_id = os.path.split(filepath)[-1].split(".")[0]
+        name = f"{act_id}-{stat.st_mtime_ns}-{stat.st_size}.arrow"
+        path = os.path.join(self.cache_dir, name)
+
+        if name in self.files:
+            self.hits += 1
+            self.files.move_to_end(name)
+            os.utime(path)  # keeps the use order after a restart
+            return pl.read_ipc(path, columns=columns)
+
+        self.misses += 1
+        points = load_parquet(filepath)
+        # remove versions of changed sources
+        for old in [f for f in self.files if f.rsplit("-", 2)[0] == act_id]:
+            self.remove(old)
+        # a temporary file per writer, concurrent loads of one activity
+        # must not write to the same file
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            tmp_path = f.name
+        try:
+            points.write_ipc(tmp_path, compression="uncompressed")
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.files[name] = os.path.getsize(path)
+        self.evict()
+        return points if columns is None else points.select(columns)
+
+    def remove(self, name: str):
+        """Delete one cache file."""
+        del self.files[name]
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Remove least recently used files until under budget."""
+        total = self.size()
+        while self.files and total > self.max_bytes:
+            name, size = next(iter(self.files.items()))
+            self.remove(name)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all cache files."""
+        for name in list(self.files):
+            self.remove(name)
+
+
+def lod_points(points: pl.DataFrame) -> pl.DataFrame:
+    """Points of an activity with their level of detail.
+
+    "tolerance" is the Douglas-Peucker tolerance (m) that keeps a point in the
+    track (``statsf.track_tolerances``), "alt_level" the level of min/max
+    downsampling that keeps it in the altitude series
+    (``statsf.minmax_levels``). Only points kept at ``LOD_MIN_TOLERANCE_M`` or
+    a level of ``LOD_ALT_LEVELS`` are returned. Select a level with
+    ``lod_select``.
+    """
+    tolerances = statsf.track_tolerances(points["lat"], points["long"])
+    if "alt_enh" in points.columns and points["alt_enh"].is_not_null().any():
+        alt_levels = statsf.minmax_levels(points["alt_enh"], LOD_ALT_LEVELS)
+    else:
+        alt_levels = np.full(len(points), 255, dtype=np.uint8)
+    return points.with_columns(
+        tolerance=pl.Series(tolerances, dtype=pl.Float32),
+        alt_level=pl.Series(alt_levels, dtype=pl.UInt8),
+    ).filter((pl.col("tolerance") >= LOD_MIN_TOLERANCE_M) | (pl.col("alt_level") < 255))
+
+
+def lod_select(
+    lod: pl.DataFrame,
+    max_points=LOD_MAX_POINTS,
+    kind: Literal["track", "alt"] = "track",
+    bounds: tuple = None,
+) -> pl.DataFrame:
+    """Select at most max_points of a ``lod_points`` frame.
+
+    ## Parameters
+    - lod (pl.DataFrame)
+    - max_points (int)
+    - kind (str): "track" keeps the points with largest tolerance, "alt" the
+        finest altitude level that fits.
+    - bounds (tuple): min_lat, max_lat, min_long, max_long (degrees), only
+        points in the viewport, and their neighbours so lines leave it.
+
+    ## Returns
+    - points (pl.DataFrame): in time order.
+    """
+    if bounds is not None:
+        min_lat, max_lat, min_long, max_long = (round(b * 2**31 / 180) for b in bounds)
+        inside = pl.col("lat").is_between(min_lat, max_lat) & pl.col("long").is_between(
+            min_long, max_long
+        )
+        lod = lod.filter(
+            inside
+            | inside.shift(1).fill_null(False)
+            | inside.shift(-1).fill_null(False)
+        )
+
+    if kind == "alt":
+        levels = [k for k in LOD_ALT_LEVELS if 2 * 2**k + 2 <= max_points]
+        level = max(levels, default=min(LOD_ALT_LEVELS))
+        return lod.filter(pl.col("alt_level") <= level)
+    track = lod.filter(pl.col("tolerance") >= LOD_MIN_TOLERANCE_M)
+    keep = statsf.lod_indices(track["tolerance"].to_numpy(), max_points)
+    return track[keep]
+
+
+def load_lod(
+    act_id: str,
+    lod_dir: str,
+    act_dir: str,
+    max_points=LOD_MAX_POINTS,
+    kind: Literal["track", "alt"] = "track",
+    bounds: tuple = None,
+    cache: "ActivityCache" = None,
+) -> pl.DataFrame:
+    """Load the points of an activity to plot, at a level of detail.
+
+    The levels are saved per activity in lod_dir ("<id>.parquet", see
+    ``lod_points``), made from the point file when missing or older.
+
+    ## Parameters
+    - act_id (str)
+    - lod_dir (str): folder of the level of detail files.
+    - act_dir (str): folder with the .parquet point files.
+    - max_points, kind, bounds: see ``lod_select``.
+    - cache (ActivityCache): to load the level of detail file, if given. Use
+        a cache folder for level of detail files only, the cache is by id.
+
+    ## Returns
+    - points (pl.DataFrame)
+    """
+    path = os.path.join(lod_dir, act_id + ".parquet")
+    source = os.path.join(act_dir, act_id + ".parquet")
+    if (
+        os.path.exists(path)
+        and os.stat(path).st_mtime_ns >= os.stat(source).st_mtime_ns
+    ):
+        lod = cache.load(path) if cache is not None else pl.read_parquet(path)
+    else:
+        lod = lod_points(load_parquet(source))
+        os.makedirs(lod_dir, exist_ok=True)
+        safe_save(lod, path, check_read="footer")
+    return lod_select(lod, max_points, kind, bounds)
+
+
+def update_lod(act_dir: str, lod_dir: str, verbose=False) -> int:
+    """Make the level of detail files of all new or changed activities.
+
+    ## Returns
+    - n_updated (int)
+    """
+    os.makedirs(lod_dir, exist_ok=True)
+    sources = scan_sources(act_dir, [".parquet"])
+    saved = scan_sources(lod_dir, [".parquet"])
+    todo = sources.join(
+        saved.select("path", lod_mtime_ns="mtime_ns"), on="path", how="left"
+    ).filter(
+        pl.col("lod_mtime_ns").is_null() | (pl.col("lod_mtime_ns") < pl.col("mtime_ns"))
+    )
+    for i, path in enumerate(todo["path"]):
+        lod = lod_points(load_parquet(os.path.join(act_dir, path)))
+        safe_save(lod, os.path.join(lod_dir, path), check_read="footer")
+        if verbose:
+            print(f"level of detail {i+1}/{len(todo)}: {path}")
+    return len(todo)
+
+
+def is_compact(file) -> bool:
+    """Whether a point file (path or its schema) is in the compact format."""
+    if not isinstance(file, dict):
+        file = pl.read_parquet_schema(file)
+    return file.get("time") == COMPACT_ENCODING["time"][0]
+
+
+def load_compact(
+    filepath: str,
+    columns: list[str] = None,
+    time_range: tuple = None,
+    n_rows: int = None,
+) -> pl.DataFrame:
+    """Load and decode a compact point file, see ``load_parquet``.
+
+    Only columns and row limit are pushed into the read. The time range is
+    applied after decoding, since row group statistics of deltas say nothing
+    about the time.
+    """
+    read_cols = None
+    if columns is not None:
+        extra = ["time"] if time_range is not None else []
+        read_cols = list(dict.fromkeys(columns + extra))
+    points = decode_compact(
+        pl.read_parquet(
+            filepath,
+            columns=read_cols,
+            n_rows=n_rows if time_range is None else None,
+        )
+    )
+    if time_range is not None:
+        points = points.filter(time_filter(*time_range))
+        if n_rows is not None:
+            points = points.head(n_rows)
+    if columns is not None:
+        points = points.select(columns)
+    return points
+
+
+def delta_encode(values: pl.Series, order: int) -> pl.Series:
+    """Replace values by their differences, ``order`` times.
+
+    The first value is kept. Null values are left in place and skipped, so
+    ``cum_sum`` (which skips nulls) ``order`` times gives back the values.
+    """
+    valid = values.drop_nulls()
+    if valid.is_empty():
+        return values
+    for _ in range(order):
+        valid = valid.diff().fill_null(valid[0])
+    if len(valid) == len(values):
+        return valid
+    return pl.Series(values.name, [None] * len(values), valid.dtype).scatter(
+        values.is_not_null().arg_true(), valid
+    )
+
+
+def encode_compact(points: pl.DataFrame) -> pl.DataFrame:
+    """Encode points for compact storage, as in ``COMPACT_ENCODING``.
+
+    Time and coordinates are delta encoded, speed and altitude are stored as
+    scaled integer deltas. Mostly constant steps compress well with zstd.
+    Columns of Null type are kept as they are.
+
+    ## Parameters
+    - points (pl.DataFrame): columns as ``DEF_PL_PARQ_SCH``.
+
+    ## Returns
+    - encoded (pl.DataFrame): decode with ``decode_compact``.
+    """
+    columns = []
+    for col in points.columns:
+        values = points[col]
+        if col not in COMPACT_ENCODING or values.dtype == pl.Null:
+            columns.append(values)
+            continue
+        dtype, scale, order = COMPACT_ENCODING[col]
+        if col == "time":
+            values = values.dt.epoch("us")
+        elif scale != 1:
+            values = (values * scale).round()
+        values = values.cast(pl.Int64, strict=False)
+        columns.append(delta_encode(values, order).cast(dtype))
+    return pl.DataFrame(columns)
+
+
+def decode_compact(encoded: pl.DataFrame, over: str = None) -> pl.DataFrame:
+    """Decode points encoded by ``encode_compact`` (also for pl.LazyFrame).
+
+    ``cum_sum`` skips nulls, as they were skipped when encoding. With
+    ``over``, a column of activity ids, many activities are decoded at once.
+    """
+    exprs = []
+    for col, dtype in encoded.collect_schema().items():
+        if col not in COMPACT_ENCODING or dtype == pl.Null:
+            continue
+        _, scale, order = COMPACT_ENCODING[col]
+        expr = pl.col(col).cast(pl.Int64)
+        for _ in range(order):
+            expr = expr.cum_sum()
+        if over is not None and order:
+            expr = expr.over(over)
+        if scale != 1:
+            expr = expr / scale
+        exprs.append(expr.cast(COMPACT_SCHEMA[col]))
+    return encoded.with_columns(exprs)
+
+
+def convert_compact(folder: str, folder_out: str = None, verbose=True):
+    """Write copies of activity point files in the compact format.
+
+    About half the size, but slower to load (see experiments.md), so meant
+    for archiving, the app reads the plain files. Files that are already
+    compact are skipped.
+
+    ## Parameters
+    - folder (str): folder with .parquet point files.
+    - folder_out (str): destination, default folder + "_compact". Can be
+        folder to replace the files.
+    - verbose (bool): print progress.
+
+    ## Returns
+    - sizes (pl.DataFrame): name, size (bytes) before and after.
+    """
+    folder_out = folder_out or os.path.normpath(folder) + "_compact"
+    os.makedirs(folder_out, exist_ok=True)
+    files = find_importable(folder, [".parquet"])
+    rows = []
+    for i, (name, path, size) in enumerate(
+        ([] if files is None else files.select("name", "path", "size").rows())
+    ):
+        path_out = os.path.join(folder_out, name + ".parquet")
+        if is_compact(path):
+            continue
+        safe_save(
+            encode_compact(pl.read_parquet(path)),
+            path_out,
+            check_read="footer",
+            row_group_size=POINTS_ROW_GROUP_SIZE,
+            compression_level=COMPACT_ZSTD_LEVEL,
+        )
+        rows.append((name, size, os.path.getsize(path_out)))
+        if verbose and (i + 1) % 100 == 0:
+            print(f"converted {i+1}/{len(files)}")
+
+    return pl.DataFrame(
+        rows,
+        schema={"name": pl.String, "size": pl.Int64, "size_compact": pl.Int64},
+        orient="row",
+    )
+
+
+def time_filter(start=None, end=None) -> pl.Expr:
+    """Expression selecting rows with "time" in [start, end).
+
+    Naive datetimes are taken as UTC, to compare with the UTC point times.
+    """
+    cond = pl.lit(True)
+    if start is not None:
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        cond = cond & (pl.col("time") >= start)
+    if end is not None:
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        cond = cond & (pl.col("time") < end)
+    return cond
+
+
+def scan_points_dataset(dataset_dir: str) -> pl.LazyFrame:
+    """Lazy scan of the points of all activities in a dataset.
+
+    The dataset (made by ``migrate_points_dataset``) has one file per year,
+    "year=YYYY/points.parquet", sorted by id and time. Filtering on "year"
+    skips files, filtering on "id" skips row groups using their statistics.
+
+    ## Returns
+    - points (pl.LazyFrame): columns "year" and ``DATASET_SCHEMA``.
+    """
+    return pl.scan_parquet(
+        os.path.join(dataset_dir, "year=*", "points.parquet"),
+        hive_partitioning=True,
+        schema=DATASET_SCHEMA,
+        hive_schema={"year": pl.Int32},
+    )
+
+
+def load_activity_dataset(
+    dataset_dir: str, act_id: str, columns: list[str] = None, year: int = None
+) -> pl.DataFrame:
+    """Load the points of one activity from a dataset.
+
+    ## Parameters
+    - dataset_dir (str)
+    - act_id (str)
+    - columns (list[str]): columns to load, default all in ``DEF_PL_PARQ_SCH``.
+    - year (int): start year (UTC) of the activity, if known only that
+        file is opened.
+
+    ## Returns
+    - points (pl.DataFrame): empty if the id is not in the dataset.
+    """
+    lazy = scan_points_dataset(dataset_dir)
+    if year is not None:
+        lazy = lazy.filter(pl.col("year") == year)
+    lazy = lazy.filter(pl.col("id") == act_id)
+    return lazy.select(columns or list(DEF_PL_PARQ_SCH.keys())).collect()
+
+
+def dataset_ids(dataset_dir: str) -> pl.DataFrame:
+    """Ids and years of the activities in a dataset (empty if none)."""
+    if not glob(os.path.join(dataset_dir, "year=*", "points.parquet")):
+        return pl.DataFrame(schema={"id": pl.String, "year": pl.Int32})
+    return scan_points_dataset(dataset_dir).select("id", "year").unique().collect()
+
+
+def migrate_points_dataset(act_dir: str, dataset_dir: str, verbose=True) -> list[str]:
+    """Copy per-activity files into one dataset partitioned by year.
+
+    Points (.parquet, also compact ones) are added to
+    "year=YYYY/points.parquet", by the start year (UTC) of each activity.
+    Metadata (_meta.json) is collected in "metadata.parquet". Activities
+    already in the dataset are skipped, so this can be run again after
+    importing more activities. Only the years with new activities are
+    rewritten, one at a time, so only one year of points is in memory.
+    Activities without points or times have no year, they are reported and
+    not added.
+
+    ## Parameters
+    - act_dir (str): folder with .parquet and _meta.json files.
+    - dataset_dir (str): destination folder.
+    - verbose (bool): print progress.
+
+    ## Returns
+    - added (list[str]): ids of added activities.
+    """
+    done = set(dataset_ids(dataset_dir)["id"])
+    files = find_importable(act_dir, [".parquet"])
+    if files is None:
+        return []
+    files = files.filter(~pl.col("name").is_in(done))
+    paths = dict(files.select("name", "path").rows())
+
+    # start year of each activity, reading only the times
+    years = (
+        scan_point_files(list(paths.values()))
+        .group_by("id")
+        .agg(year=pl.col("time").min().dt.year())
+        .collect(engine="streaming")
+    )
+    years = pl.DataFrame({"id": list(paths)}, schema={"id": pl.String}).join(
+        years, on="id", how="left", maintain_order="left"
+    )
+    no_year = years.filter(pl.col("year").is_null())["id"].to_list()
+    if verbose and no_year:
+        print(f"skipped {len(no_year)} activities without times: {', '.join(no_year)}")
+
+    added = []
+    by_year = years.drop_nulls("year").group_by("year").agg("id").sort("year")
+    for year, ids in by_year.rows():
+        points = pl.concat(
+            load_parquet(paths[a])
+            .with_columns(id=pl.lit(a))
+            .select(pl.col(k).cast(v) for k, v in DATASET_SCHEMA.items())
+            for a in ids
+        )
+        path = os.path.join(dataset_dir, f"year={year}", "points.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            points = pl.concat([pl.read_parquet(path), points])
+        safe_save(
+            points.sort("id", "time"),
+            path,
+            row_group_size=POINTS_ROW_GROUP_SIZE,
+        )
+        del points
+
+        # metadata of the year, so that a stopped migration is consistent
+        metadata = [
+            pl.DataFrame([load_json(os.path.join(act_dir, a + "_meta.json"))])
+            for a in ids
+            if os.path.exists(os.path.join(act_dir, a + "_meta.json"))
+        ]
+        if metadata:
+            meta_path = os.path.join(dataset_dir, "metadata.parquet")
+            if os.path.exists(meta_path):
+                metadata.insert(0, pl.read_parquet(meta_path))
+            safe_save(pl.concat(metadata, how="diagonal_relaxed"), meta_path)
+        added.extend(ids)
+        if verbose:
+            print(f"saved {year}: {len(ids)} activities added")
+    return added
+
+
+def save_json(filepath, obj):
+    """Save object as JSON.
+
+    ## Parameters
+    - filepath (str): destination file. Will be compressed if ends with '.gz'."""
+
+    if filepath[-3:] == ".gz":
+        json_bytes = json.dumps(obj, default=serialize_json).encode("utf-8")
+        with gzip.open(filepath, mode="w") as f:
+            f.write(json_bytes)
+    else:
+        with open(filepath, mode="w", encoding="utf8") as f:
+            json.dump(obj, f, default=serialize_json, indent=0)
+
+    return True
+
+
+def load_json(filepath: str, enc="utf8") -> dict:
+    """Load..."""
+    with open_source(filepath) as f:
+        return json.loads(f.read().decode(enc))
+
+
+def save_settings(filepath: str, settings_dict: dict):
+    with open(filepath, "w") as f:
+        json.dump(settings_dict, f, indent=4)
+
+
+def load_all_gpx(folder: str, sample=0) -> list[gpxpy.gpx.GPX]:
+    """Load all gpx files in folder, using ``gpxpy``.
+
+    ## Parameters
+    - folder (str) - where to look for files.
+    - sample (int) - if positive, only load a random sample of files.
+
+    ## Returns
+    - activities (list) - list of gpxpy.gpx.GPX objects.
+    """
+    activities = []
+    filenames = glob("*.gpx", root_dir=folder)
+
+    if sample > 0:
+        filenames = np.random.choice(filenames, sample)
+
+    for i, file in enumerate(filenames):
+        with open(os.path.join(folder, file), "r", encoding="utf8") as f:
+            gpx = gpxpy.parse(f, "lxml")
+        if gpx.tracks and gpx.tracks[0].segments and gpx.tracks[0].segments[0].points:
+            # add if not empty
+            activities.append(gpx)
+
+    return activities
+
+
+def load_one_gpx(filepath: str):
+    with open(filepath, "r", encoding="utf8") as f:
+        gpx = gpxpy.parse(f, "lxml")
+    if gpx.tracks and gpx.tracks[0].segments and gpx.tracks[0].segments[0].points:
+        return gpx
+
+
+def load_gpx_polars(filepath: str, data: bytes = None):
+    """Load a .gpx-file, or compressed .gpx.gz-file, by streaming trackpoints.
+
+    Trackpoints are parsed incrementally (``lxml.etree.iterparse``) into numpy
+    arrays, and released from the XML tree when read, so no ``gpxpy`` object
+    graph is built. All tracks and segments are included, in file order.
+
+    ## Parameters
+    - filepath (str)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict): name, desc, comment, type and source of the first track.
+    - points (pl.DataFrame): same columns as ``convert_fit_polars``, with lat/long
+        in semicircles. Speed and heart rate are read from extensions.
+    """
+
+    # preallocated, grown when full. NaN for missing values
+    cols = {
+        k: np.full(1024, np.nan) for k in ("lat", "long", "alt_enh", "speed_enh", "hr")
+    }
+    times = []
+    metadata = {}
+    n = 0
+
+    with open_source(filepath, data) as f:
+        for _, elem in etree.iterparse(f, events=("end",), tag=("{*}trkpt", "{*}trk")):
+            if elem.tag.endswith("trk"):
+                if not metadata:
+                    metadata = {
+                        "name": elem.findtext("{*}name"),
+                        "desc": elem.findtext("{*}desc"),
+                        "comment": elem.findtext("{*}cmt"),
+                        "type": elem.findtext("{*}type"),
+                        "source": elem.findtext("{*}src"),
+                    }
+                elem.clear()
+                continue
+
+            if n == len(cols["lat"]):
+                for k in cols:
+                    cols[k] = np.concatenate([cols[k], np.full(n, np.nan)])
+
+            cols["lat"][n] = elem.get("lat")
+            cols["long"][n] = elem.get("lon")
+            time = None
+            for child in elem.iter():
+                tag = child.tag.rpartition("}")[2]
+                if tag == "ele":
+                    cols["alt_enh"][n] = child.text
+                elif tag == "time":
+                    time = child.text
+                elif tag == "hr":
+                    cols["hr"][n] = child.text
+                elif tag == "speed":
+                    cols["speed_enh"][n] = child.text
+            times.append(time)
+            n += 1
+
+            # drop parsed points from the tree
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    points = points_from_degrees(
+        time=pl.Series(times, dtype=pl.String),
+        **{k: pl.Series(v[:n]).fill_nan(None) for k, v in cols.items()},
+    )
+    return metadata, points
+
+
+def points_from_degrees(time, lat, long, speed_enh=None, alt_enh=None, hr=None):
+    """Build a points dataframe in the common schema from parsed columns.
+
+    Columns can be anything ``pl.Series`` accepts, strings are cast in bulk.
+    Raise ValueError if a value can not be cast (e.g. a malformed time).
+
+    ## Parameters
+    - time: datetimes, or ISO 8601 strings.
+    - lat, long: degrees, converted to semicircles as in fit files.
+    - speed_enh (m/s), alt_enh (m), hr (bpm): optional.
+
+    ## Returns
+    - points (pl.DataFrame): columns as ``DEF_PL_PARQ_SCH``
+    """
+    n = len(time)
+    time = pl.Series("time", time)
+    factor = 2**31 / 180  # degrees to semicircles
+    try:
+        if time.dtype == pl.String:
+            time = time.str.to_datetime(time_unit="us", time_zone="UTC")
+        elif time.dtype == pl.Datetime and time.dtype.time_zone is None:
+            time = time.dt.replace_time_zone("UTC")
+
+        cols = {"time": time.cast(DEF_PL_PARQ_SCH["time"])}
+        for name, values, dtype in [
+            ("lat", lat, pl.Float64),
+            ("long", long, pl.Float64),
+            ("speed_enh", speed_enh, pl.Float64),
+            ("alt_enh", alt_enh, pl.Float64),
+            ("hr", hr, pl.Float64),
+        ]:
+            if values is None:
+                values = [None] * n
+            cols[name] = pl.Series(name, values).cast(dtype)
+
+        return pl.DataFrame(cols).with_columns(
+            (pl.col("lat", "long") * factor).round().cast(pl.Int64),
+            pl.col("hr").round().cast(pl.UInt16),
+        )
+    except (pl.exceptions.ComputeError, pl.exceptions.InvalidOperationError) as e:
+        # cast errors name the column and value on the first line
+        raise ValueError(f"invalid point values: {str(e).splitlines()[0]}") from e
+
+
+def load_tcx_polars(filepath: str, data: bytes = None):
+    """Load a .tcx-file, or compressed .tcx.gz-file, by streaming trackpoints.
+
+    All laps and tracks are included. Values are collected as text and cast
+    per column.
+
+    ## Parameters
+    - filepath (str)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict): sport_main, from the first activity.
+    - points (pl.DataFrame): same columns as ``convert_fit_polars``.
+    """
+
+    fields = {
+        "Time": "time",
+        "LatitudeDegrees": "lat",
+        "LongitudeDegrees": "long",
+        "AltitudeMeters": "alt_enh",
+        "Value": "hr",  # only HeartRateBpm has a Value in trackpoints
+        "Speed": "speed_enh",
+    }
+    sports = {"running": "running", "biking": "cycling"}
+
+    metadata = {}
+
+    def on_other(elem):
+        if elem.tag.endswith("Activity") and not metadata:
+            sport = (elem.get("Sport") or "").lower()
+            metadata["sport_main"] = sports.get(sport, sport or None)
+
+    cols = stream_xml_points(
+        filepath,
+        "Trackpoint",
+        fields,
+        other_tags=("Activity",),
+        on_other=on_other,
+        data=data,
+    )
+    return metadata, points_from_degrees(**cols)
+
+
+def load_kml_polars(filepath: str, data: bytes = None):
+    """Load a .kml-file, or compressed .kml.gz-file.
+
+    Reads timed points, either one ``Placemark`` with a ``Point`` and a
+    ``TimeSpan``/``TimeStamp`` per point (Garmin export), or ``gx:Track``
+    elements. Without timed points, the coordinates of the first
+    ``LineString`` are used, without time.
+
+    ## Parameters
+    - filepath (str)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict): name of the top level folder or document.
+    - points (pl.DataFrame): same columns as ``convert_fit_polars``.
+    """
+
+    # Garmin writes the time of a point as the end of its span
+    fields = {"coordinates": "coords", "end": "end", "begin": "begin", "when": "when"}
+
+    metadata = {}
+    track_times, track_coords, line = [], [], []
+
+    def on_other(elem):
+        tag = elem.tag.rpartition("}")[2]
+        if tag == "name" and not metadata:
+            metadata["name"] = elem.text
+        elif tag == "Track":
+            track_times.extend(e.text for e in elem.iterfind("{*}when"))
+            track_coords.extend(
+                e.text.replace(" ", ",") for e in elem.iterfind("{*}coord")
+            )
+        elif tag == "LineString" and not line:
+            line.extend((elem.findtext("{*}coordinates") or "").split())
+
+    cols = stream_xml_points(
+        filepath,
+        "Placemark",
+        fields,
+        other_tags=("name", "Track", "LineString"),
+        on_other=on_other,
+        required="coords",
+        data=data,
+    )
+    times = pl.Series(cols["end"], dtype=pl.String)
+    times = times.fill_null(pl.Series(cols["begin"], dtype=pl.String))
+    times = times.fill_null(pl.Series(cols["when"], dtype=pl.String))
+    coords = cols["coords"]
+    has_time = times.is_not_null()
+
+    if has_time.any():
+        times = times.filter(has_time).append(pl.Series(track_times, dtype=pl.String))
+        coords = pl.Series(coords, dtype=pl.String).filter(has_time)
+        coords = coords.append(pl.Series(track_coords, dtype=pl.String))
+    elif track_times:
+        times, coords = track_times, track_coords
+    else:
+        times, coords = [None] * len(line), line
+
+    parts = pl.Series(coords, dtype=pl.String).str.split(",")
+    return metadata, points_from_degrees(
+        time=pl.Series(times, dtype=pl.String),
+        long=parts.list.get(0, null_on_oob=True).str.strip_chars(),
+        lat=parts.list.get(1, null_on_oob=True).str.strip_chars(),
+        alt_enh=parts.list.get(2, null_on_oob=True).str.strip_chars(),
+    )
+
+
+def load_csv_polars(filepath: str, data: bytes = None):
+    """Load points from a .csv-file, or compressed .csv.gz-file.
+
+    Columns are matched by name (see ``CSV_COLUMNS``). Lat/long are read as
+    degrees, or as semicircles if integers outside +-180.
+
+    Raise ValueError if there are no time or position columns (for example
+    a lap summary), or if the file or a value can not be parsed.
+
+    ## Parameters
+    - filepath (str)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict): empty.
+    - points (pl.DataFrame): same columns as ``convert_fit_polars``.
+    """
+
+    with open_source(filepath, data) as f:
+        try:
+            df = pl.read_csv(f, infer_schema_length=1000)
+        except pl.exceptions.ComputeError as e:
+            raise ValueError(f"invalid csv: {str(e).splitlines()[0]}") from e
+
+    cols = {}
+    for col in df.columns:
+        target = CSV_COLUMNS.get(col.strip().lower())
+        if target and target not in cols:
+            cols[target] = df[col]
+
+    if not {"time", "lat", "long"}.issubset(cols):
+        raise ValueError("no time and position columns")
+
+    for k in ("lat", "long"):
+        if cols[k].dtype.is_integer() and cols[k].abs().max() > 180:
+            cols[k] = cols[k] / (2**31 / 180)
+
+    time = cols.pop("time")
+    if time.dtype.is_integer():  # unix seconds
+        time = pl.from_epoch(time, time_unit="s")
+    return {}, points_from_degrees(time=time, **cols)
+
+
+def stream_xml_points(
+    filepath: str,
+    point_tag: str,
+    fields: dict,
+    other_tags=(),
+    on_other=None,
+    required=None,
+    data: bytes = None,
+) -> dict[str, list]:
+    """Collect the text of some sub-elements of each point element in an XML file.
+
+    Parsed incrementally, points are dropped from the tree when read.
+
+    ## Parameters
+    - filepath (str): compressed if ending with ".gz".
+    - point_tag (str): local name of point elements, e.g. "Trackpoint".
+    - fields (dict): local names of sub-elements to column names.
+    - other_tags (tuple): local names of other elements, passed to ``on_other``.
+    - required (str): skip points without this column.
+    - data (bytes): decompressed file content, if already read.
+
+    ## Returns
+    - columns (dict): column name to list of strings (or None), per point.
+    """
+
+    cols = {k: [] for k in fields.values()}
+    tags = ["{*}" + point_tag] + ["{*}" + t for t in other_tags]
+
+    with open_source(filepath, data) as f:
+        for _, elem in etree.iterparse(f, events=("end",), tag=tags):
+            if not elem.tag.endswith("}" + point_tag):
+                on_other(elem)
+                continue
+
+            values = {}
+            for child in elem.iter():
+                col = fields.get(child.tag.rpartition("}")[2])
+                if col and col not in values:
+                    values[col] = child.text
+
+            if required is None or required in values:
+                for col, vals in cols.items():
+                    vals.append(values.get(col))
+
+            # drop parsed points from the tree
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    return cols
+
+
+def load_fit(filepath: str, data: bytes = None):
+    """Load a .fit-file, or compressed .fit.gz-file.
+
+    Extract point-wise data from data-message named "record".
+
+    ## Parameters
+    - filepath (str)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict)
+    - points (dict)
+    """
+
+    record_fields = {
+        "timestamp": "time",
+        "position_lat": "lat",
+        "position_long": "long",
+        "enhanced_speed": "speed_enh",
+        "enhanced_altitude": "alt_enh",
+        "heart_rate": "hr",
+    }
+
+    points = {k: [] for k in record_fields.values()}
+    metadata = {}
+
+    with open_source(filepath, data) as f:
+        with fitdecode.FitReader(f, check_crc=fitdecode.CrcCheck.RAISE) as fit:
+            for frame in fit:
+                # frame with data?
+                if frame.frame_type == fitdecode.FIT_FRAME_DATA:
+                    if frame.name == "record":
+                        for k in record_fields.keys():
+                            points[record_fields[k]].append(
+                                frame.get_value(k, fallback=None)
+                            )
+                    elif frame.name == "sport":
+                        sport_name = frame.get_value("name")
+                        sport_main = frame.get_value("sport")
+                        metadata["sport_spec"] = sport_name
+                        metadata["sport_main"] = sport_main
+
+        return metadata, points
+
+
+def fit_crc(data: bytes, crc=0) -> int:
+    """CRC-16 as used in FIT headers and files."""
+    table = FIT_CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def load_fit_columnar(filepath: str, check_crc=True, data: bytes = None):
+    """Load a .fit-file, or compressed .fit.gz-file, decoding "record" messages in bulk.
+
+    Fast alternative to ``load_fit``. The file is walked once to read the
+    definition messages and to locate data messages. The bytes of all "record"
+    messages sharing a definition are then gathered and unpacked at once with a
+    structured numpy dtype, with scale, offset and invalid values applied per
+    column.
+
+    ## Parameters
+    - filepath (str)
+    - check_crc (bool): raise OSError if a header or file CRC does not match.
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict)
+    - points (pl.DataFrame): same as ``pl.DataFrame(load_fit(filepath)[1])``.
+    """
+
+    with open_source(filepath, data) as f:
+        data = f.read()
+
+    metadata = {}
+    defs = []  # all definitions, in order of appearance
+    local_defs = {}  # local message number -> index in defs
+    rec_pos = []  # start of each "record" message content
+    rec_def = []  # its definition
+    rec_ts = []  # its compressed timestamp, or -1
+    last_ts = 0
+
+    pos = 0
+    while pos < len(data):  # may be several chained FIT files
+        header_size = data[pos]
+        if header_size < 12 or data[pos + 8 : pos + 12] != b".FIT":
+            raise ValueError("not a FIT file")
+        body_size = int.from_bytes(data[pos + 4 : pos + 8], "little")
+        end = pos + header_size + body_size
+        if end + 2 > len(data):
+            raise ValueError("FIT file truncated")
+
+        if check_crc:
+            if header_size >= 14:
+                crc = int.from_bytes(data[pos + 12 : pos + 14], "little")
+                if crc and crc != fit_crc(data[pos : pos + 12]):
+                    raise OSError("FIT header CRC mismatch")
+            if fit_crc(data[pos:end]) != int.from_bytes(data[end : end + 2], "little"):
+                raise OSError("FIT file CRC mismatch")
+
+        pos += header_size
+        while pos < end:
+            head = data[pos]
+            if head & 0x40 and not head & 0x80:  # definition message
+                big = data[pos + 2] == 1
+                fields = []  # (number, offset, size, base type)
+                size = 0
+                p = pos + 6
+                for _ in range(data[pos + 5]):
+                    fields.append((data[p], size, data[p + 1], data[p + 2]))
+                    size += data[p + 1]
+                    p += 3
+                if head & 0x20:  # developer fields
+                    n_dev = data[p]
+                    p += 1
+                    for _ in range(n_dev):
+                        size += data[p + 1]
+                        p += 3
+                ts_field = [f for f in fields if f[0] == 253 and f[2] == 4]
+                local_defs[head & 0x0F] = len(defs)
+                defs.append(
+                    {
+                        "mesg": int.from_bytes(
+                            data[pos + 3 : pos + 5], "big" if big else "little"
+                        ),
+                        "endian": ">" if big else "<",
+                        "size": size,
+                        "fields": fields,
+                        "ts_offset": ts_field[0][1] if ts_field else None,
+                    }
+                )
+                pos = p
+                continue
+
+            # data message
+            if head & 0x80:  # compressed timestamp header
+                local = (head >> 5) & 0x03
+            else:
+                local = head & 0x0F
+            if local not in local_defs:
+                raise ValueError(f"local message {local} not defined")
+            d_idx = local_defs[local]
+            d = defs[d_idx]
+
+            if d["ts_offset"] is not None:
+                start = pos + 1 + d["ts_offset"]
+                ts = int.from_bytes(
+                    data[start : start + 4], "big" if d["endian"] == ">" else "little"
+                )
+                if ts != 0xFFFFFFFF:
+                    last_ts = ts
+            ts = -1
+            if head & 0x80:
+                offset = head & 0x1F
+                ts = (last_ts & ~0x1F) + offset
+                if offset < (last_ts & 0x1F):
+                    ts += 0x20
+                last_ts = ts
+
+            if d["mesg"] == FIT_MESG_RECORD:
+                rec_pos.append(pos + 1)
+                rec_def.append(d_idx)
+                rec_ts.append(ts)
+            elif d["mesg"] == FIT_MESG_SPORT:
+                metadata.update(decode_fit_sport(data, pos + 1, d))
+            pos += 1 + d["size"]
+        pos = end + 2
+
+    points = unpack_fit_records(
+        np.frombuffer(data, dtype=np.uint8),
+        defs,
+        np.array(rec_pos, dtype=np.int64),
+        np.array(rec_def, dtype=np.int64),
+        np.array(rec_ts, dtype=np.int64),
+    )
+    return metadata, points
+
+
+def decode_fit_sport(data: bytes, start: int, d: dict) -> dict:
+    """Decode sport name and main sport of a "sport" message, like fitdecode."""
+    sport_types = fitdecode.profile.FIELD_TYPES["sport"].enum
+    values = {"sport_spec": None, "sport_main": None}
+    for num, offset, size, base in d["fields"]:
+        raw = data[start + offset : start + offset + size]
+        if num == 3 and base == 0x07:  # name (string)
+            values["sport_spec"] = (
+                raw.split(b"\x00")[0].decode("utf-8", "replace") or None
+            )
+        elif num == 0 and size == 1 and raw[0] != 0xFF:  # sport (enum)
+            values["sport_main"] = sport_types.get(raw[0], raw[0])
+    return values
+
+
+def unpack_fit_records(buf, defs, positions, def_idx, comp_ts) -> pl.DataFrame:
+    """Unpack located "record" messages to columns, one definition at a time."""
+    n = len(positions)
+    values = {
+        col: np.zeros(
+            n, dtype=np.int64 if col in ("time", "lat", "long", "hr") else np.float64
+        )
+        for col in FIT_RECORD_FIELDS
+    }
+    valid = {col: np.zeros(n, dtype=bool) for col in FIT_RECORD_FIELDS}
+
+    for k in np.unique(def_idx):
+        d = defs[k]
+        sel = np.nonzero(def_idx == k)[0]
+
+        # pick source field per column, first in definition order
+        picked = {}
+        for num, offset, size, base in d["fields"]:
+            if base not in FIT_BASE_TYPES:
+                continue
+            fmt, invalid = FIT_BASE_TYPES[base]
+            if np.dtype(fmt).itemsize != size:
+                continue
+            for col, candidates in FIT_RECORD_FIELDS.items():
+                for c_num, scale, c_offset in candidates:
+                    if c_num == num and col not in picked:
+                        picked[col] = (
+                            f"f{num}",
+                            d["endian"] + fmt,
+                            offset,
+                            invalid,
+                            scale,
+                            c_offset,
+                        )
+
+        names = [p[0] for p in picked.values()]
+        dtype = np.dtype(
+            {
+                "names": names,
+                "formats": [p[1] for p in picked.values()],
+                "offsets": [p[2] for p in picked.values()],
+                "itemsize": d["size"],
+            }
+        )
+        # gather message bytes to a contiguous block and view as records
+        block = buf[positions[sel, None] + np.arange(d["size"])]
+        recs = block.reshape(-1).view(dtype)
+
+        for col, (name, _, _, invalid, scale, offset) in picked.items():
+            raw = recs[name].astype(np.int64)
+            ok = raw != invalid
+            if scale or offset:
+                raw = raw.astype(np.float64)
+            if scale:
+                raw = raw / scale
+            if offset:
+                raw = raw - offset
+            values[col][sel] = raw
+            valid[col][sel] = ok
+
+    # compressed timestamps, used when there is no timestamp field
+    use_comp = (~valid["time"]) & (comp_ts >= 0)
+    values["time"][use_comp] = comp_ts[use_comp]
+    valid["time"] |= use_comp
+    valid["time"] &= values["time"] >= FIT_DATETIME_MIN
+
+    columns = []
+    for col in FIT_RECORD_FIELDS:
+        if not valid[col].any():
+            columns.append(pl.Series(col, [None] * n))
+            continue
+        series = pl.Series(col, values[col])
+        if col == "time":
+            series = ((series + FIT_EPOCH) * 1_000_000).cast(
+                pl.Datetime(time_unit="us", time_zone="UTC")
+            )
+        if not valid[col].all():
+            series = series.scatter(np.nonzero(~valid[col])[0], None)
+        columns.append(series)
+    return pl.DataFrame(columns)
+
+
+def find_importable(folder: str, extensions=IMPORT_TYPES):
+    """Find all files that could be imported as activities.
+
+    Members of zip archives in the folder (or folder being a zip archive) are
+    included without extracting, with paths like "export.zip/member", that
+    can be read with ``open_source``.
+    """
+
+    def add_archive(archive):
+        for info in zip_members(archive, extensions):
+            filename = info.filename.split("/")[-1]
+            name = filename.split(".")[0]
+            extension = next(e for e in extensions if filename.endswith(e))
+            file_path = os.path.join(archive, info.filename)
+            matches.append((name, file_path, info.file_size, extension))
+
+    matches = []
+    if os.path.isfile(folder) and folder.lower().endswith(ARCHIVE_TYPES):
+        add_archive(folder)
+    for root, _, filenames in os.walk(folder):
+        for extension in extensions:
+            for filename in fnmatch.filter(filenames, f"*{extension}"):
+                name = filename.split(".")[0]
+                file_path = os.path.join(root, filename)
+                file_size = os.path.getsize(file_path)
+                matches.append((name, file_path, file_size, extension))
+        for filename in filenames:
+            if filename.lower().endswith(ARCHIVE_TYPES):
+                add_archive(os.path.join(root, filename))
+
+    if not matches:
+        return None
+
+    df = pl.DataFrame(matches, schema=["name", "path", "size", "type"], orient="row")
+    return df.sort("name", "type")
+
+
+def convert_fit_polars(filepath, fast=True, data: bytes = None):
+    """Load a fit file to a dict of metadata and a dataframe of points.
+
+    ## Parameters
+    - filepath (str)
+    - fast (bool): use ``load_fit_columnar`` instead of ``load_fit``.
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict):
+    - points (pl.DataFrame):
+    """
+
+    act_id = os.path.split(filepath)[-1].split(".")[0]
+    if fast:
+        metadata, points = load_fit_columnar(filepath, data=data)
+    else:
+        metadata, points = load_fit(filepath, data)
+        points = pl.DataFrame(points)
+    metadata["id"] = act_id
+
+    points = points.with_columns(points["hr"].cast(pl.UInt16))
+    return metadata, points
+
+
+def convert_gpx_polars(filepath, data: bytes = None):
+    """Load a gpx file to a dict of metadata and a dataframe of points.
+
+    ## Parameters
+    - filepath (str)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict):
+    - points (pl.DataFrame):
+    """
+
+    act_id = os.path.split(filepath)[-1].split(".")[0]
+    metadata, points = load_gpx_polars(filepath, data)
+    metadata["id"] = act_id
+    metadata["sport_spec"] = metadata.get("type")
+    return metadata, points
+
+
+def convert_polars(filepath, data: bytes = None):
+    """Load any file in ``CONVERT_TYPES`` to metadata and points.
+
+    ## Parameters
+    - filepath (str)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+
+    ## Returns
+    - metadata (dict): including "id", from the filename.
+    - points (pl.DataFrame): columns as ``DEF_PL_PARQ_SCH``.
+    """
+
+    base = filepath[:-3] if filepath[-3:] == ".gz" else filepath
+    if base.endswith(".fit"):
+        return convert_fit_polars(filepath, data=data)
+    elif base.endswith(".gpx"):
+        return convert_gpx_polars(filepath, data)
+    elif base.endswith(".tcx"):
+        metadata, points = load_tcx_polars(filepath, data)
+    elif base.endswith(".kml"):
+        metadata, points = load_kml_polars(filepath, data)
+    elif base.endswith(".csv"):
+        metadata, points = load_csv_polars(filepath, data)
+    else:
+        raise ValueError(f"unsupported file type: {filepath}")
+
+    metadata["id"] = os.path.split(filepath)[-1].split(".")[0]
+    return metadata, points
+
+
+def convert_save(
+    fp: str,
+    folder_out: str,
+    overwrite=False,
+    data: bytes = None,
+    writer: "BatchWriter" = None,
+) -> str:
+    """Convert one activity file and save points (.parquet) and metadata (_meta.json).
+
+    Module-level so that it can be sent to worker processes.
+
+    ## Parameters
+    - fp (str)
+    - folder_out (str)
+    - overwrite (bool)
+    - data (bytes): decompressed content, if already read (see ``open_source``).
+    - writer (BatchWriter): if given, files are saved in its batch. Else they
+        are a batch of their own, synced to disk the same way (e.g. in worker
+        processes).
+
+    ## Returns
+    - act_id (str)
+    """
+    metadata, points = convert_polars(fp, data)
+    act_id = metadata["id"]
+    with BatchWriter() if writer is None else nullcontext(writer) as batch:
+        batch.save(
+            points,
+            os.path.join(folder_out, act_id + ".parquet"),
+            overwrite,
+            row_group_size=POINTS_ROW_GROUP_SIZE,
+        )
+        batch.save(metadata, os.path.join(folder_out, act_id + "_meta.json"), overwrite)
+    return act_id
+
+
+def convert_save_first(
+    fps: list[str],
+    folder_out: str,
+    overwrite=False,
+    data: bytes = None,
+    writer: "BatchWriter" = None,
+):
+    """Try ``convert_save`` on files of the same activity until one works.
+
+    If given, data is the content of the first file.
+
+    ## Returns
+    - act_id (str|None): None if no file could be converted.
+    - source (str|None): the file that was converted.
+    - errors (list[str]): messages of files that failed, with one of
+        ``SOURCE_ERRORS`` (e.g. csv without points, bad CRC, truncated gzip).
+    """
+    errors = []
+    for fp in fps:
+        try:
+            return convert_save(fp, folder_out, overwrite, data, writer), fp, errors
+        except SOURCE_ERRORS as e:
+            errors.append(f"{fp}: {e!r}")
+        data = None
+    return None, None, errors
 
-        skip = False
-        if (not overwrite) and os.path.exists(path_out):
-            skip = True
 
+def act_outputs(act_id: str) -> list[str]:
+    """Names of the files written by ``convert_save`` for an activity."""
+    return [act_id + ".parquet", act_id + "_meta.json"]
+
+
+def convert_all_fit_polars(
+    folder_in: str,
+    folder_out: str,
+    overwrite=False,
+    verbose=True,
+    workers=1,
+    manifest_path: str = None,
+):
+    """Convert all fit files in a folder, see ``convert_all_polars``."""
+    return convert_all_polars(
+        folder_in,
+        folder_out,
+        [".fit", ".fit.gz"],
+        overwrite,
+        verbose,
+        workers,
+        manifest_path,
+    )
+
+
+def convert_all_polars(
+    folder_in: str,
+    folder_out: str,
+    extensions=CONVERT_TYPES,
+    overwrite=False,
+    verbose=True,
+    workers=1,
+    manifest_path: str = None,
+):
+    """Convert all activity files in a folder to parquet points and json metadata.
+
+    Files with the same id (name before the first ".") give the same output,
+    by default the first one (sorted by extension) that can be converted is kept.
+    Files that can not be read or decoded (``SOURCE_ERRORS``, e.g. csv without
+    points, bad CRC) are reported and skipped. With a manifest they are
+    recorded without outputs, and only tried again when they change.
+
+    ## Parameters
+    - folder_in (str): where to look for files, or a zip archive. Members of
+        zip archives are read without extracting (see ``find_importable``).
+    - folder_out (str): destination folder.
+    - extensions (list[str]): types to convert, from ``CONVERT_TYPES``.
+    - overwrite (bool): convert again and replace existing output.
+    - verbose (bool): print progress.
+    - workers (int): number of processes. If >1, files are converted in parallel
+        and progress is reported in completion order.
+    - manifest_path (str): if given, only consider files that are new or changed
+        since the last run according to this import manifest (see
+        ``diff_manifest``). Changed files are always converted again. The
+        outputs of deleted files are removed, or converted again from another
+        file with the same id.
+
+    ## Returns
+    - converted (list[str]): ids of converted activities.
+    """
+    if manifest_path is None:
+        found = find_importable(folder_in, extensions=extensions)
+        files = [] if found is None else found["path"].to_list()
+        force = set()
+    else:
+        # entries of other types are kept as they are
+        manifest = load_manifest(manifest_path)
+        scanned = pl.any_horizontal(pl.col("path").str.ends_with(e) for e in extensions)
+        other = manifest.filter(~scanned)
+        changes = diff_manifest(
+            manifest.filter(scanned), scan_sources(folder_in, extensions), folder_in
+        )
         if verbose:
-            print(f"{i+1:5d}/{len(files)}: {act_id}", "(skip)" * skip)
-
-        if not skip:
-            metadata, points = convert_fit_polars(fp)
-            safe_save(points, path_out, overwrite, check_read=True)
-            safe_save(
-                metadata,
-                os.path.join(folder_out, act_id + "_meta.json"),
-                overwrite,
-                check_read=True,
+            print(", ".join(f"{k}: {len(v)}" for k, v in changes.items()))
+
+        # outputs of a deleted source are converted again from another
+        # source of the same id, or removed if there is none
+        stem = pl.col("path").str.extract(r"([^/\\.]+)[^/\\]*$")
+        deleted = changes["deleted"].filter(pl.col("outputs").list.len() > 0)
+        deleted_ids = deleted.select(stem)["path"].implode()
+        again = changes["unchanged"].filter(stem.is_in(deleted_ids))
+        unchanged = changes["unchanged"].filter(~stem.is_in(deleted_ids))
+        new = pl.concat([changes["added"], changes["modified"], again]).sort("path")
+        remaining = set(pl.concat([new, other]).select(stem)["path"])
+        for act_id, path, outputs in deleted.select(
+            stem.alias("id"), "path", "outputs"
+        ).rows():
+            if act_id in remaining:
+                continue
+            for name in outputs:
+                try:
+                    os.remove(os.path.join(folder_out, name))
+                except FileNotFoundError:
+                    pass
+            if verbose:
+                print(f"source deleted: {path}, removed {', '.join(outputs)}")
+
+        files = [os.path.join(folder_in, p) for p in new["path"]]
+        force = {
+            os.path.join(folder_in, p)
+            for p in new.filter(
+                pl.col("path").is_in(changes["modified"]["path"].implode())
+                | stem.is_in(deleted_ids)
+            )["path"]
+        }
+
+    # source: act_id, of the files that were converted
+    produced = {}
+    # files that were converted, skipped or failed, recorded in the manifest
+    # even if the run stops on an unexpected error
+    attempted = set()
+    try:
+        if workers <= 1:
+            convert_serial(
+                files, folder_out, overwrite, force, verbose, produced, attempted
+            )
+        else:
+            produced.update(
+                convert_parallel(files, folder_out, overwrite, force, verbose, workers)
+            )
+            attempted.update(files)
+    finally:
+        if manifest_path is not None:
+            done = pl.col("path").map_elements(
+                lambda p: os.path.join(folder_in, p) in attempted,
+                return_dtype=pl.Boolean,
+            )
+            # sources not handled keep their old rows (and deleted sources
+            # of their id), so that the next run finds the same changes
+            not_done = new.filter(~done)
+            old = manifest.filter(
+                pl.col("path").is_in(not_done["path"].implode())
+                | (
+                    pl.col("path").is_in(deleted["path"].implode())
+                    & stem.is_in(not_done.select(stem)["path"].implode())
+                )
+            )
+            save_manifest(
+                manifest_path,
+                [unchanged, other, old],
+                new.filter(done),
+                {os.path.relpath(k, folder_in): v for k, v in produced.items()},
+                folder_out,
+            )
+
+    return list(produced.values())
+
+
+def convert_serial(
+    files: list[str],
+    folder_out: str,
+    overwrite=False,
+    force=(),
+    verbose=True,
+    produced: dict = None,
+    attempted: set = None,
+):
+    """Convert activity files one by one, see ``convert_all_polars``.
+
+    Files are read ahead on threads (``prefetch_sources``) and outputs are
+    moved in place (and synced) in batches (``BatchWriter``).
+
+    ## Parameters
+    - files (list[str]): paths to convert, sorted as by ``find_importable``.
+    - force (set[str]): paths that are converted even if output exists.
+    - produced (dict): filled with source file: id, of converted activities.
+    - attempted (set): filled with the files that were handled.
+    """
+    produced = {} if produced is None else produced
+    attempted = set() if attempted is None else attempted
+    writer = BatchWriter()
+
+    def skip(fp):
+        act_id = os.path.split(fp)[-1].split(".")[0]
+        path_out = os.path.join(folder_out, act_id + ".parquet")
+        exists = os.path.exists(path_out) or path_out in writer
+        return (not overwrite) and (fp not in force) and exists
+
+    # read ahead the files that are not skipped already
+    todo = [fp for fp in files if not skip(fp)]
+    sources = prefetch_sources(todo)
+    todo = set(todo)
+
+    with writer:
+        for i, fp in enumerate(files):
+            act_id = os.path.split(fp)[-1].split(".")[0]
+
+            data = None
+            if fp in todo:
+                _, data = next(sources)
+
+            # check again, may be converted from another file now
+            skipped = skip(fp)
+
+            if verbose:
+                print(f"{i+1:5d}/{len(files)}: {act_id}", "(skip)" * skipped)
+
+            if not skipped:
+                act_id, source, errors = convert_save_first(
+                    [fp], folder_out, overwrite or fp in force, data, writer
+                )
+                if act_id:
+                    produced[source] = act_id
+                if verbose and errors:
+                    print("       (failed)", *errors)
+            attempted.add(fp)
+    return produced
+
+
+def save_manifest(
+    manifest_path: str,
+    kept: list[pl.DataFrame],
+    new: pl.DataFrame,
+    produced: dict[str, str],
+    folder_out: str,
+):
+    """Save the import manifest after a conversion run.
+
+    ## Parameters
+    - manifest_path (str)
+    - kept (list[pl.DataFrame]): manifest rows that stay as they are.
+    - new (pl.DataFrame): rows of the new or changed sources that were
+        handled, outputs are set here.
+    - produced (dict[str, str]): source path (relative): id, converted.
+    - folder_out (str): where the outputs are.
+    """
+    # outputs are recorded for the source they were converted from, not for
+    # skipped or failed sources of the same id. An output that exists but no
+    # source claims (e.g. written before a crash) goes to the first source
+    # with its id, so that it is not orphaned.
+    claimed = {f for frame in kept for f in frame["outputs"].explode().drop_nulls()} | {
+        f for a in produced.values() for f in act_outputs(a)
+    }
+    outputs = []
+    for p in new["path"]:
+        if p in produced:
+            outputs.append(act_outputs(produced[p]))
+            continue
+        found = [
+            f
+            for f in act_outputs(os.path.split(p)[-1].split(".")[0])
+            if f not in claimed and os.path.exists(os.path.join(folder_out, f))
+        ]
+        claimed.update(found)
+        outputs.append(found)
+
+    new = new.with_columns(
+        pl.Series("outputs", outputs, dtype=pl.List(pl.String))
+    ).select(MANIFEST_SCHEMA.keys())
+    manifest = pl.concat([*kept, new]).sort("path")
+    safe_save(manifest, manifest_path, check_read=True)
+
+
+def convert_parallel(
+    files: list[str],
+    folder_out: str,
+    overwrite=False,
+    force=(),
+    verbose=True,
+    workers=2,
+):
+    """Convert activity files on a process pool, see ``convert_all_polars``.
+
+    ## Parameters
+    - files (list[str]): paths to convert, sorted as by ``find_importable``.
+    - force (set[str]): paths that are converted even if output exists.
+
+    ## Returns
+    - produced (dict[str, str]): source file: id, of converted activities in
+        completion order.
+    """
+
+    # one job per id, trying files in the order that gives the same result as
+    # the serial loop (first when not overwriting, last when overwriting).
+    jobs = {}
+    for fp in files:
+        act_id = os.path.split(fp)[-1].split(".")[0]
+        if (
+            overwrite
+            or fp in force
+            or not os.path.exists(os.path.join(folder_out, act_id + ".parquet"))
+        ):
+            jobs.setdefault(act_id, []).append(fp)
+    for act_id, fps in jobs.items():
+        if overwrite or force.intersection(fps):
+            fps.reverse()
+
+    if verbose:
+        print(f"converting {len(jobs)} activities, {workers} workers")
+
+    produced = {}
+    # polars is multithreaded and not fork-safe, use fresh processes
+    with ProcessPoolExecutor(workers, mp_context=get_context("spawn")) as pool:
+        futures = {
+            pool.submit(
+                convert_save_first,
+                fps,
+                folder_out,
+                overwrite or force.intersection(fps),
+            ): act_id
+            for act_id, fps in jobs.items()
+        }
+        for i, fut in enumerate(as_completed(futures)):
+            act_id, source, errors = fut.result()
+            if act_id:
+                produced[source] = act_id
+            if verbose:
+                print(
+                    f"{i+1:5d}/{len(jobs)}: {futures[fut]}", "(failed)" * (not act_id)
+                )
+                if errors:
+                    print("       ", *errors)
+    return produced
+
+
+def scan_sources(folder: str, extensions=IMPORT_TYPES) -> pl.DataFrame:
+    """List importable files with size and modification time.
+
+    Like ``find_importable``, but uses one ``os.scandir`` pass where the stat
+    result comes with the directory listing.
+
+    Members of zip archives are listed from the archive directory, with the
+    uncompressed size and the stored modification time.
+
+    ## Returns
+    - sources (pl.DataFrame): path (relative to folder), size, mtime_ns
+    """
+    extensions = tuple(extensions)
+    rows = []
+
+    def add_archive(archive, prefix):
+        for info in zip_members(archive, extensions):
+            rows.append(
+                (
+                    os.path.join(prefix, info.filename),
+                    info.file_size,
+                    zip_member_mtime_ns(info),
+                )
             )
 
+    stack = []
+    if os.path.isfile(folder) and folder.lower().endswith(ARCHIVE_TYPES):
+        add_archive(folder, "")
+    else:
+        stack.append(folder)
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(ARCHIVE_TYPES):
+                    add_archive(entry.path, os.path.relpath(entry.path, folder))
+                elif entry.name.endswith(extensions):
+                    stat = entry.stat()
+                    rows.append(
+                        (
+                            os.path.relpath(entry.path, folder),
+                            stat.st_size,
+                            stat.st_mtime_ns,
+                        )
+                    )
+
+    return pl.DataFrame(
+        rows,
+        schema={k: MANIFEST_SCHEMA[k] for k in ("path", "size", "mtime_ns")},
+        orient="row",
+    )
+
+
+def file_hash(filepath: str, chunk_size=1 << 20) -> str:
+    """Content hash (blake2b, 128 bit) of a file.
+
+    For members of zip archives, the CRC-32 and size stored in the archive are
+    used instead, so that the member does not have to be decompressed.
+    """
+    archive, member = split_zip_path(filepath)
+    if member is not None:
+        info = open_zip(archive).getinfo(member)
+        return f"zip:{info.CRC:08x}:{info.file_size}"
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(filepath: str) -> pl.DataFrame:
+    """Load an import manifest, or an empty one if the file does not exist."""
+    if not os.path.exists(filepath):
+        return pl.DataFrame(schema=MANIFEST_SCHEMA)
+    return pl.read_parquet(filepath).cast(MANIFEST_SCHEMA)
+
+
+def diff_manifest(
+    manifest: pl.DataFrame, sources: pl.DataFrame, folder: str
+) -> dict[str, pl.DataFrame]:
+    """Compare current source files to an import manifest.
+
+    Files are only hashed when new, or when size or modification time changed.
+    A file that was touched but has the same content counts as unchanged.
+
+    ## Parameters
+    - manifest (pl.DataFrame): from ``load_manifest``.
+    - sources (pl.DataFrame): from ``scan_sources(folder)``.
+    - folder (str): the scanned folder, to read files for hashing.
+
+    ## Returns
+    - changes (dict): "added", "modified", "deleted" and "unchanged" rows, all
+        with the manifest columns. For deleted files these are the old rows.
+    """
+    deleted = manifest.join(sources, on="path", how="anti")
+    added = sources.join(manifest, on="path", how="anti")
+    common = sources.join(manifest, on="path", how="inner", suffix="_old")
+
+    stat_changed = (pl.col("size") != pl.col("size_old")) | (
+        pl.col("mtime_ns") != pl.col("mtime_ns_old")
+    )
+    unchanged = common.filter(~stat_changed)
+    suspect = common.filter(stat_changed).with_columns(
+        hash_new=pl.col("path").map_elements(
+            lambda p: file_hash(os.path.join(folder, p)), return_dtype=pl.String
+        )
+    )
+    touched = suspect.filter(pl.col("hash_new") == pl.col("hash"))
+    modified = suspect.filter(pl.col("hash_new") != pl.col("hash")).with_columns(
+        hash=pl.col("hash_new")
+    )
+    added = added.with_columns(
+        hash=pl.col("path").map_elements(
+            lambda p: file_hash(os.path.join(folder, p)), return_dtype=pl.String
+        ),
+        outputs=pl.lit([], dtype=pl.List(pl.String)),
+    )
 
-def safe_save(obj, filepath: str, overwrite=True, check_read=False):
+    cols = list(MANIFEST_SCHEMA.keys())
+    return {
+        "added": added.select(cols).cast(MANIFEST_SCHEMA),
+        "modified": modified.select(cols),
+        "deleted": deleted,
+        "unchanged": pl.concat([unchanged.select(cols), touched.select(cols)]),
+    }
+
+
+def safe_save(
+    obj,
+    filepath: str,
+    overwrite=True,
+    check_read=False,
+    row_group_size: int = None,
+    compression_level: int = None,
+    fsync=False,
+):
     """Safely save data as file.
 
     ## Parameters
-    - obj (pl.Dataframe|dict|list)
+    - obj (pl.Dataframe|dict|list|np.ndarray|bytes)
     - filepath (str): destination file including extension
     - overwrite (bool): allow replacing files with same name
-    - check_read (bool): read file after saving and check equal to obj.
+    - check_read (bool|str): read file after saving and check equal to obj.
+        If "footer", only check the file bytes against a checksum, and the
+        parquet footer (see ``check_written``), without decoding the data.
+    - row_group_size (int): rows per parquet row group, default polars'.
+    - compression_level (int): zstd level for parquet, default polars'.
+    - fsync (bool): flush the file to disk before it replaces the old one, so
+        that it is complete after a crash. See ``BatchWriter`` for many files.
 
     """
 
     if (not overwrite) and os.path.exists(filepath):
         raise FileExistsError("file exists, overwrite not enabled")
 
-    # Save dataframe
-    if isinstance(obj, pl.DataFrame) and filepath[-7:] == "parquet":
-        # save temporary
-        with open(filepath + ".tmp", "wb") as f:
-            obj.write_parquet(f)
+    data = serialize_file(obj, filepath, row_group_size, compression_level)
+    if data is None:
+        return NotImplemented
 
-        os.replace(filepath + ".tmp", filepath)
+    # save temporary, a file per call so that concurrent saves of one path
+    # (e.g. web requests) do not write to the same file
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(filepath) or ".", suffix=".tmp", delete=False
+    ) as f:
+        try:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+
+    os.replace(f.name, filepath)
+
+    if check_read == "footer":
+        check_written(obj, filepath, data)
+    elif check_read and isinstance(obj, pl.DataFrame):
+        with open(filepath, "rb") as f:
+            test = pl.read_parquet(f)
+        if not obj.equals(test):
+            raise OSError("File read check failed.")
+    elif check_read and isinstance(obj, (np.ndarray, bytes)):
+        check_written(obj, filepath, data)
+    elif check_read:
+        with open(filepath, encoding="utf8") as f:
+            test = json.load(f)
+        if not obj == test:
+            raise OSError("File read check failed.")
+    return True
 
-        if check_read:
-            with open(filepath, "rb") as f:
-                test = pl.read_parquet(f)
-            if not obj.equals(test):
-                raise OSError("File read check failed.")
-        return True
-    # Save JSON
+
+def serialize_file(
+    obj, filepath: str, row_group_size: int = None, compression_level: int = None
+) -> bytes:
+    """Content of the file that ``safe_save`` writes.
+
+    ## Returns
+    - data (bytes|None): None if the type of obj and the extension do not
+        match a supported format (DataFrame as parquet, dict/list as json,
+        array as compressed npz, bytes as is).
+    """
+    if isinstance(obj, pl.DataFrame) and filepath[-7:] == "parquet":
+        buffer = io.BytesIO()
+        obj.write_parquet(
+            buffer, row_group_size=row_group_size, compression_level=compression_level
+        )
+        return buffer.getvalue()
     elif isinstance(obj, (dict, list)) and filepath[-4:] == "json":
-        # save temporary
-        with open(filepath + ".tmp", mode="w", encoding="utf8") as f:
-            json.dump(obj, f, default=serialize_json, indent=4)
+        return json.dumps(obj, default=serialize_json, indent=4).encode("utf8")
+    elif isinstance(obj, np.ndarray) and filepath[-3:] == "npz":
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, obj)
+        return buffer.getvalue()
+    elif isinstance(obj, bytes):
+        return obj
+    return None
+
+
+def check_written(obj, filepath: str, data: bytes):
+    """Check a saved file without decoding it.
+
+    The file must have the checksum of the bytes that were written. For a
+    parquet file, the footer must have the schema and number of rows of obj.
+    Raises OSError if not.
+    """
+    with open(filepath, "rb") as f:
+        written = f.read()
+    digest = hashlib.blake2b(written, digest_size=16).digest()
+    if digest != hashlib.blake2b(data, digest_size=16).digest():
+        raise OSError("File checksum check failed.")
+
+    if isinstance(obj, pl.DataFrame):
+        schema = pl.read_parquet_schema(io.BytesIO(written))
+        n_rows = pl.scan_parquet(io.BytesIO(written)).select(pl.len()).collect()
+        if schema != obj.schema or n_rows.item() != obj.height:
+            raise OSError("File footer check failed.")
 
-        os.replace(filepath + ".tmp", filepath)
 
-        if check_read:
-            with open(filepath, encoding="utf8") as f:
-                test = json.load(f)
-            if not obj == test:
-                raise OSError("File read check failed.")
+class BatchWriter:
+    """Atomic writes of many small files, moved in place in batches.
+
+    Files are written to temporary files when saved. When the batch is full
+    (and when leaving the ``with`` block, also on an error) each of them is
+    synced to disk and moved in place, then the folders are synced once.
+    After a crash, a file is either the old or the new complete version. A
+    saved file is not visible until the batch is flushed, check with ``in``.
+
+    ## Parameters
+    - batch_size (int): number of files moved in place at once.
+    - check_read (bool): check files after moving them, with ``check_written``.
+    """
+
+    def __init__(self, batch_size=64, check_read=True) -> None:
+        self.batch_size = batch_size
+        self.check_read = check_read
+        # filepath: (obj, data, temporary file)
+        self.pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # files saved before an error are complete, keep them
+        try:
+            self.flush()
+        finally:
+            self.discard()
+
+    def __contains__(self, filepath: str) -> bool:
+        return filepath in self.pending
+
+    def save(
+        self,
+        obj,
+        filepath: str,
+        overwrite=True,
+        row_group_size: int = None,
+        compression_level: int = None,
+    ):
+        """Add a file to the batch, see ``safe_save``."""
+        if (not overwrite) and (os.path.exists(filepath) or filepath in self):
+            raise FileExistsError("file exists, overwrite not enabled")
+
+        data = serialize_file(obj, filepath, row_group_size, compression_level)
+        if data is None:
+            return NotImplemented
+
+        # a temporary file per save, as in ``safe_save``
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(filepath) or ".", suffix=".tmp", delete=False
+        ) as f:
+            try:
+                f.write(data)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        if filepath in self.pending:
+            # saved again before the flush, the new version replaces it
+            os.remove(self.pending.pop(filepath)[2])
+        self.pending[filepath] = (obj, data, f.name)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
         return True
-    else:
-        return NotImplemented
+
+    def flush(self):
+        """Sync the saved files to disk and move them in place."""
+        if not self.pending:
+            return
+
+        for filepath, (_, _, tmp_path) in self.pending.items():
+            with open(tmp_path, "rb+") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        # make the renames durable too
+        if os.name == "posix":
+            for folder in {os.path.dirname(fp) or "." for fp in self.pending}:
+                fd = os.open(folder, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+        pending, self.pending = self.pending, {}
+        if self.check_read:
+            for filepath, (obj, data, _) in pending.items():
+                check_written(obj, filepath, data)
+
+    def discard(self):
+        """Remove the temporary files of the batch, if not flushed."""
+        for _, _, tmp_path in self.pending.values():
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+        self.pending = {}
@@ -1,10 +1,17 @@
+import struct
+import zlib
+
 import gpxpy
 import gpxpy.gpx
+import numpy as np
 from plotly import express as px, graph_objects as go, subplots as ps, io as pio
 import polars as pl
 from datetime import datetime, timedelta
 from typing import Literal
 
+from app_functions import data_functions as dataf
+from app_functions import stats_functions as statsf
+
 PLOT_TEMPLATE = pio.templates["plotly_dark"]
 PLOT_TEMPLATE.layout.autosize = False
 PLOT_TEMPLATE.layout.width = 500
@@ -16,18 +23,34 @@ PLOT_TEMPLATE.layout.dragmode = "pan"
 pio.templates.default = PLOT_TEMPLATE
 
 
-def plot_one_gpx(gpx: gpxpy.gpx.GPX = None, show_grid=False) -> go.Figure:
+def plot_one_gpx(
+    gpx: gpxpy.gpx.GPX = None, show_grid=False, max_points=dataf.LOD_MAX_POINTS
+) -> go.Figure:
     """Create a figure for one gpx.
-    Note: supports only single track, single segment, gpx files"""
+    Note: supports only single track, single segment, gpx files
+
+    Trace and altitude are simplified to at most max_points each."""
 
     if not gpx:
         return go.Figure()
 
     points = gpx.tracks[0].segments[0].points
-    lat = [p.latitude for p in points]
-    lon = [p.longitude for p in points]
-    elev = [p.elevation for p in points]
-    time = [p.time for p in points]
+    factor = 2**31 / 180  # degrees to semicircles
+    keep = statsf.lod_indices(
+        statsf.track_tolerances(
+            [p.latitude * factor for p in points],
+            [p.longitude * factor for p in points],
+        ),
+        max_points,
+    )
+    lat = [points[i].latitude for i in keep]
+    lon = [points[i].longitude for i in keep]
+    keep = statsf.minmax_downsample(
+        [p.elevation if p.elevation is not None else np.nan for p in points],
+        max_points // 2 - 1,
+    )
+    elev = [points[i].elevation for i in keep]
+    time = [points[i].time for i in keep]
     act_name = gpx.tracks[0].name if gpx.name else "Activity"
     length_km = gpx.tracks[0].length_2d() / 1000
 
@@ -211,7 +234,7 @@ def multi_summary_hist(
 
 def summary_hist(
     summary: pl.DataFrame,
-    y: Literal["count", "length"] = "count",
+    y: Literal["count", "length", "elev_gain"] = "count",
 ):
     """Plot a histogram of a time-interval summary."""
 
@@ -236,8 +259,12 @@ def summary_hist(
     return fig
 
 
-def plot_points_geo(lat, long):
-    """A simple plot of geographic points"""
+def plot_points_geo(lat, long, max_points=dataf.LOD_MAX_POINTS):
+    """A simple plot of geographic points, simplified to at most max_points"""
+
+    if len(lat) > max_points:
+        keep = statsf.lod_indices(statsf.track_tolerances(lat, long), max_points)
+        lat, long = np.asarray(lat)[keep], np.asarray(long)[keep]
 
     fig = go.Figure()
 
@@ -260,11 +287,31 @@ def plot_points_geo(lat, long):
     return fig
 
 
-def points_map(data: pl.DataFrame, setbounds=False):
-    """Plot points on a open-street-map"""
+def points_map(
+    data: pl.DataFrame,
+    setbounds=False,
+    heatmap_url: str = None,
+    max_points=dataf.LOD_MAX_POINTS,
+    view: tuple = None,
+):
+    """Plot points on a open-street-map
+
+    heatmap_url: tile url of the heatmap layer, e.g.
+    "http://127.0.0.1:8050/heatmap/{z}/{x}/{y}.png" (see ``app.py``).
+    Tracks are simplified to at most max_points.
+    view: min_lat, max_lat, min_long, max_long (degrees) to show at first,
+    e.g. a region of ``dataf.activity_regions``.
+    """
     FACTOR_DEG = 2**32 / 360  # convert integers to degrees
     MAP_MARGIN = 0.05  # degrees margin when setting bounds
 
+    if len(data) > max_points:
+        data = data[
+            statsf.lod_indices(
+                statsf.track_tolerances(data["lat"], data["long"]), max_points
+            )
+        ]
+
     fig = px.scatter_mapbox(
         lat=data["lat"] / FACTOR_DEG,
         lon=data["long"] / FACTOR_DEG,
@@ -276,6 +323,22 @@ def points_map(data: pl.DataFrame, setbounds=False):
     )
     fig.update_layout(mapbox_style="open-street-map")
     fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    if heatmap_url:
+        fig.update_layout(
+            mapbox_layers=[
+                {"sourcetype": "raster", "source": [heatmap_url], "below": "traces"}
+            ]
+        )
+
+    if view is not None:
+        min_lat, max_lat, min_long, max_long = view
+        lat = (min_lat + max_lat) / 2
+        # zoom where the box fits in a tile (512 px), lat stretched by mercator
+        span = max(max_long - min_long, (max_lat - min_lat) / np.cos(np.radians(lat)))
+        fig.update_layout(
+            mapbox_center={"lat": lat, "lon": (min_long + max_long) / 2},
+            mapbox_zoom=float(np.clip(np.log2(360 / max(span, 1e-3)), 0, 16)),
+        )
 
     if setbounds:
         fig.update_layout(
@@ -287,3 +350,36 @@ def points_map(data: pl.DataFrame, setbounds=False):
             }
         )
     return fig
+
+
+def heatmap_png(counts: np.ndarray, vmax: float = 50) -> bytes:
+    """PNG image (RGBA) of a heatmap tile, see ``dataf.HeatmapTiles``.
+
+    Colors go from red over yellow to white on a log scale up to vmax,
+    pixels without counts are transparent.
+    """
+    height, width = counts.shape
+    v = np.clip(np.log1p(counts) / np.log1p(vmax), 0, 1)
+    rgba = np.stack(
+        [
+            np.clip(3 * v, 0, 1),
+            np.clip(3 * v - 1, 0, 1),
+            np.clip(3 * v - 2, 0, 1),
+            np.where(counts > 0, 0.4 + 0.6 * v, 0),
+        ],
+        axis=-1,
+    )
+    rgba = (rgba * 255).astype(np.uint8).reshape(height, width * 4)
+    # each row starts with filter type 0 (none)
+    raw = np.insert(rgba, 0, 0, axis=1).tobytes()
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(tag + data)
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
@@ -17,6 +17,7 @@ def summary_interval(
         - duration
         - length
         - count
+        - elev_gain, moving_time (if in index)
         - label
     """
 
@@ -31,6 +32,11 @@ def summary_interval(
         .agg(
             pl.col("duration").sum(),
             pl.col("length").sum(),
+            *[
+                pl.col(c).sum()
+                for c in ("elev_gain", "moving_time")
+                if c in act_index.columns
+            ],
             count=pl.len(),
         )
         .with_columns(date=pl.col("start_time").cast(pl.Date))
@@ -102,12 +108,15 @@ def eddington_nbr_old(act_index: dict) -> int:
 def trace_distance(
     points: pl.DataFrame,
     method: Literal["haversine", "small-angle"] = "haversine",
+    three_d: bool = False,
 ):
     """Compute distance between succesive points (haversine formula)
 
     ## Parameters
-    - points (pl.DataFrame): containing integer lat/long
-    - TODO 3D distance ?
+    - points (pl.DataFrame): containing integer lat/long and time
+    - method: "haversine" or "small-angle"
+    - three_d (bool): include the smoothed altitude differences (see
+        ``step_distance_3d``), needs alt_enh.
 
     ## Returns
     - result (pl.DataFrame)
@@ -118,69 +127,429 @@ def trace_distance(
 
     if not {"lat", "long"}.issubset(points.columns):
         raise ValueError("missing columns 'lat' or 'long'.")
+    if three_d and "alt_enh" not in points.columns:
+        raise ValueError("missing column 'alt_enh'.")
 
-    factor = 2**32 / 360  # convert to degrees
-    R = 6371000  # approx earth radius
+    step = step_distance_3d(method) if three_d else step_distance(method)
+    hours = pl.col("time").diff().dt.total_milliseconds() / (1000 * 3600)
 
-    coords_rad: pl.DataFrame = (
-        points.select(pl.col("lat").alias("lat2"), pl.col("long").alias("lon2"))
-        / factor
-        * pi
-        / 180
+    return (
+        points.select(dist=step, speed_kmh=step / hours)
+        .with_columns(
+            pl.col("dist").cum_sum(), (pl.col("speed_kmh") / 3.6).alias("speed_ms")
+        )
+        .fill_null(0)
     )
 
-    # shifted coordinates makes pairs
-    coords_rad = coords_rad.with_columns(
-        pl.col("lat2").shift(1).alias("lat1"),
-        pl.col("lon2").shift(1).alias("lon1"),
-    )
 
-    if method == "haversine":
+def step_distance(
+    method: Literal["haversine", "small-angle"] = "haversine",
+    over: str = None,
+) -> pl.Expr:
+    """Expression of the distance (m) from the previous point.
 
-        def d_pair(lat1, lon1, lat2, lon2) -> pl.Expr:
-            return (
-                2
-                * R
-                * (
-                    (lat2 - lat1).truediv(2).sin().pow(2)
-                    + (lat1.cos() * lat2.cos()) * (lon2 - lon1).truediv(2).sin().pow(2)
-                )
-                .sqrt()
-                .arcsin()
+    Computed on integer lat/long columns, null on the first point (of each
+    activity with ``over``).
+
+    ## Parameters
+    - method: "haversine" or "small-angle"
+    - over (str): column of activity ids, the previous point is taken in the
+        same activity. Not needed in a ``group_by(...).agg`` context.
+
+    ## Returns
+    - step (pl.Expr)
+    """
+    R = 6371000  # approx earth radius
+
+    lat2 = pl.col("lat") * (pi / 2**31)
+    lon2 = pl.col("long") * (pi / 2**31)
+    lat1 = lat2.shift()
+    lon1 = lon2.shift()
+
+    if method == "haversine":
+        step = (
+            2
+            * R
+            * (
+                (lat2 - lat1).truediv(2).sin().pow(2)
+                + (lat1.cos() * lat2.cos()) * (lon2 - lon1).truediv(2).sin().pow(2)
             )
+            .sqrt()
+            .arcsin()
+        )
     elif method == "small-angle":
+        step = (
+            R
+            * (
+                ((lon2 - lon1) * (lat1 + lat2).truediv(2).cos()).pow(2)
+                + (lat2 - lat1).pow(2)
+            ).sqrt()
+        )
+    else:
+        raise ValueError("unknown method")
+
+    return step if over is None else step.over(over)
+
+
+def altitude_smoothed(window: str = "30s", over: str = None) -> pl.Expr:
+    """Expression of alt_enh averaged over a trailing time window.
+
+    GPS and barometric altitudes jitter by a few meters from point to point,
+    summing the raw differences counts that noise as climbing. Points
+    without altitude keep the last smoothed value.
+
+    ## Parameters
+    - window (str): duration of the window, e.g. "30s".
+    - over (str): column of activity ids, see ``step_distance``.
+
+    ## Returns
+    - altitude (pl.Expr): m, null until the first altitude.
+    """
+    alt = pl.col("alt_enh").rolling_mean_by("time", window).forward_fill()
+    return alt if over is None else alt.over(over)
+
+
+def step_altitude(window: str = "30s", over: str = None) -> pl.Expr:
+    """Expression of the smoothed altitude change (m) from the previous point.
+
+    Sum its positive and negative parts for the elevation gain and loss.
+    """
+    step = altitude_smoothed(window).diff()
+    return step if over is None else step.over(over)
+
+
+def step_distance_3d(
+    method: Literal["haversine", "small-angle"] = "haversine",
+    window: str = "30s",
+    over: str = None,
+) -> pl.Expr:
+    """Expression of the 3D distance (m) from the previous point.
+
+    Ground distance of ``step_distance`` with the ``step_altitude`` change,
+    the ground distance where altitude is missing.
+    """
+    step = (
+        step_distance(method).pow(2) + step_altitude(window).fill_null(0).pow(2)
+    ).sqrt()
+    return step if over is None else step.over(over)
 
-        def d_pair(lat1, lon1, lat2, lon2) -> pl.Expr:
-            return (
-                R
-                * (
-                    ((lon2 - lon1) * (lat1 + lat2).truediv(2).cos()).pow(2)
-                    + (lat2 - lat1).pow(2)
-                ).sqrt()
-            )
 
+def point_grade(
+    method: Literal["haversine", "small-angle"] = "haversine",
+    window: str = "30s",
+    min_dist: float = 10.0,
+    over: str = None,
+) -> pl.Expr:
+    """Expression of the grade (%) at each point.
+
+    Smoothed altitude change over ground distance in the trailing time
+    window, null when less than min_dist (m) was covered (stops, start).
+    """
+    dist = step_distance(method).rolling_sum_by("time", window)
+    grade = pl.when(dist >= min_dist).then(
+        100 * step_altitude(window).rolling_sum_by("time", window) / dist
+    )
+    return grade if over is None else grade.over(over)
+
+
+def trace_distance_batched(
+    points: pl.DataFrame | pl.LazyFrame,
+    method: Literal["haversine", "small-angle"] = "haversine",
+    id_col: str = "id",
+    three_d: bool = False,
+) -> pl.DataFrame | pl.LazyFrame:
+    """Distance along the points of many activities, in one query.
+
+    Batched ``trace_distance``: successive points are paired within each
+    activity, so the points of an archive can be processed in a single
+    (lazy) frame, e.g. from ``dataf.scan_point_files``.
+
+    ## Parameters
+    - points (pl.DataFrame | pl.LazyFrame): long format points, with
+        integer lat/long, time and an activity id column, each activity in
+        order.
+    - method: "haversine" or "small-angle"
+    - id_col (str): column of activity ids.
+    - three_d (bool): 3D steps (``step_distance_3d``) and grade, needs
+        alt_enh.
+
+    ## Returns
+    - points (same type as input), with columns added:
+        - step: distance from the previous point (m), 0 on the first one.
+        - dist: cumulative distance in the activity (m).
+        - speed_ms: pointwise speed (m/s), null when time does not advance.
+        - grade (%, if three_d): see ``point_grade``.
+    """
+    required = {"lat", "long", "time", id_col} | ({"alt_enh"} if three_d else set())
+    missing = required - set(points.collect_schema().names())
+    if missing:
+        raise ValueError(f"missing columns {sorted(missing)}.")
+
+    if three_d:
+        step = step_distance_3d(method, over=id_col)
+        extra = {"grade": point_grade(method, over=id_col)}
     else:
-        raise ValueError("unknown method")
+        step = step_distance(method, over=id_col)
+        extra = {}
 
-    result = pl.concat(
-        [
-            coords_rad.with_columns(
-                dist=d_pair(
-                    pl.col("lat1"), pl.col("lon1"), pl.col("lat2"), pl.col("lon2")
-                ),
-            ),
-            points.select(
-                pl.col("time").diff().dt.total_milliseconds() / (1000 * 3600)
-            ),
-        ],
-        how="horizontal",
+    step_time = pl.col("time").diff().over(id_col).dt.total_microseconds() / 1e6
+    return points.with_columns(step=step.fill_null(0), **extra).with_columns(
+        dist=pl.col("step").cum_sum().over(id_col),
+        speed_ms=pl.when(step_time > 0).then(pl.col("step") / step_time),
     )
-    return (
-        result.select(
-            pl.col("dist"), (pl.col("dist") / (pl.col("time"))).alias("speed_kmh")
+
+
+def activity_lengths(
+    points: pl.DataFrame | pl.LazyFrame,
+    method: Literal["haversine", "small-angle"] = "haversine",
+    id_col: str = "id",
+) -> pl.DataFrame | pl.LazyFrame:
+    """Total distance of many activities, in one grouped query.
+
+    ## Parameters
+    - points (pl.DataFrame | pl.LazyFrame): long format points, with
+        integer lat/long and an activity id column, each activity in order.
+        Run lazy frames with ``collect(engine="streaming")``.
+    - method: "haversine" or "small-angle"
+    - id_col (str): column of activity ids.
+
+    ## Returns
+    - lengths (same type as input): id_col, n_points, length (m), in order
+        of first appearance.
+    """
+    if not {"lat", "long", id_col}.issubset(points.collect_schema().names()):
+        raise ValueError(f"missing columns 'lat', 'long' or '{id_col}'.")
+
+    return points.group_by(id_col, maintain_order=True).agg(
+        n_points=pl.len(),
+        length=step_distance(method).sum(),
+    )
+
+
+def segment_crossings(
+    lat: np.ndarray, long: np.ndarray, segment, tolerance_m: float = 25.0
+) -> list[tuple[int, int]]:
+    """Find the efforts of a track on a segment.
+
+    An effort enters at the point closest to the segment start, and exits at
+    the point closest to the segment end, after leaving the start. If the
+    track passes the start several times before the end, the last pass is
+    the entry. Between entry and exit, the track has to pass within
+    tolerance of every vertex of the segment, in order (see
+    ``passes_in_order``). The segment can be coarse, e.g. hand drawn along
+    a winding road, the track is not compared to the chords between vertices.
+
+    Distances are computed in a plane around the segment start, which is
+    accurate for segments up to tens of km.
+
+    ## Parameters
+    - lat, long (np.ndarray): track in semicircles, nan where missing.
+    - segment: polyline as (lat, long) pairs in degrees, at least 2 points.
+    - tolerance_m (float): largest distance from the start, end and
+        segment vertices (m).
+
+    ## Returns
+    - efforts (list[tuple[int, int]]): entry and exit point index.
+    """
+    segment = np.asarray(segment, dtype=np.float64)
+    if segment.ndim != 2 or segment.shape[0] < 2 or segment.shape[1] != 2:
+        raise ValueError("segment should be at least 2 (lat, long) pairs")
+
+    # plane coordinates (m) around the segment start
+    m_per_deg = 6371000 * pi / 180
+    cos_lat = np.cos(np.radians(segment[0, 0]))
+    seg_x = (segment[:, 1] - segment[0, 1]) * cos_lat * m_per_deg
+    seg_y = (segment[:, 0] - segment[0, 0]) * m_per_deg
+    x = (np.asarray(long, dtype=np.float64) * (180 / 2**31) - segment[0, 1]) * (
+        cos_lat * m_per_deg
+    )
+    y = (np.asarray(lat, dtype=np.float64) * (180 / 2**31) - segment[0, 0]) * m_per_deg
+
+    d_start = np.hypot(x - seg_x[0], y - seg_y[0])
+    d_end = np.hypot(x - seg_x[-1], y - seg_y[-1])
+    near_start = d_start <= tolerance_m
+    near_end = np.flatnonzero(d_end <= tolerance_m)
+    if not near_start.any() or len(near_end) == 0:
+        return []
+
+    # runs of points near the start: [run_start, run_end)
+    edges = np.diff(near_start.astype(np.int8), prepend=0, append=0)
+    run_start = np.flatnonzero(edges == 1)
+    run_end = np.flatnonzero(edges == -1)
+
+    # first point near the end after each run
+    k = np.searchsorted(near_end, run_end)
+    has_exit = k < len(near_end)
+    if not has_exit.any():
+        return []
+    run_start, run_end, exit_first = (
+        run_start[has_exit],
+        run_end[has_exit],
+        near_end[k[has_exit]],
+    )
+    # entry is the last run before an exit
+    last = np.append(run_start[1:] > exit_first[:-1], True)
+
+    efforts = []
+    last_exit = -1
+    for a, b, e in zip(run_start[last], run_end[last], exit_first[last]):
+        if a <= last_exit:
+            continue
+        entry = a + np.argmin(d_start[a:b])
+        # end of the run of points near the end
+        e_stop = e + 1
+        while e_stop < len(d_end) and d_end[e_stop] <= tolerance_m:
+            e_stop += 1
+        exit = e + np.argmin(d_end[e:e_stop])
+
+        if passes_in_order(seg_x[1:-1], seg_y[1:-1], x, y, entry, exit, tolerance_m):
+            efforts.append((int(entry), int(exit)))
+            last_exit = exit
+    return efforts
+
+
+def passes_in_order(px, py, x, y, first, last, tolerance) -> bool:
+    """Whether the track passes within tolerance of the points (px, py), in
+    order, between track points first..last (plane coordinates, nan ignored).
+
+    Distances are to the lines between track points, so sparse tracks pass
+    points between two samples.
+    """
+    pos = first
+    for vx, vy in zip(px, py):
+        x0, y0 = x[pos:last], y[pos:last]
+        dx, dy = x[pos + 1 : last + 1] - x0, y[pos + 1 : last + 1] - y0
+        length2 = dx**2 + dy**2
+        t = np.clip(
+            ((vx - x0) * dx + (vy - y0) * dy) / np.where(length2 > 0, length2, 1),
+            0,
+            1,
         )
-        .with_columns(
-            pl.col("dist").cum_sum(), (pl.col("speed_kmh") / 3.6).alias("speed_ms")
+        near = np.flatnonzero(np.hypot(vx - x0 - t * dx, vy - y0 - t * dy) <= tolerance)
+        if len(near) == 0:
+            return False
+        pos += near[0]
+    return True
+
+
+def simplify_tolerances(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Douglas-Peucker tolerance of each point of a polyline.
+
+    A point is kept by Douglas-Peucker simplification with a tolerance below
+    its value, so one pass gives all levels of detail. The first and last
+    points are kept at any tolerance (inf). All intervals of one depth of the
+    recursion are split at once, with numpy. Intervals where all points are
+    on the line are not split further.
+
+    ## Parameters
+    - x, y (np.ndarray): plane coordinates, without missing values.
+
+    ## Returns
+    - tolerances (np.ndarray): same unit as x, y.
+    """
+    n = len(x)
+    tolerances = np.zeros(n)
+    if n == 0:
+        return tolerances
+    tolerances[[0, -1]] = np.inf
+
+    starts, ends, bounds = np.array([0]), np.array([n - 1]), np.array([np.inf])
+    while len(starts):
+        n_inner = ends - starts - 1
+        # points inside an interval of tolerance 0 all get 0, don't split it:
+        # splitting runs of identical points (stops) one by one is quadratic
+        split = (n_inner > 0) & (bounds > 0)
+        starts, ends, bounds, n_inner = (
+            starts[split],
+            ends[split],
+            bounds[split],
+            n_inner[split],
         )
-        .fill_null(0)
-    )
+        if not len(starts):
+            break
+
+        # distance of all inner points to the line of their interval
+        offsets = np.cumsum(n_inner) - n_inner
+        interval = np.repeat(np.arange(len(starts)), n_inner)
+        idx = starts[interval] + 1 + np.arange(n_inner.sum()) - offsets[interval]
+        ax, ay = x[starts][interval], y[starts][interval]
+        dx, dy = x[ends][interval] - ax, y[ends][interval] - ay
+        length2 = dx**2 + dy**2
+        t = np.clip(
+            ((x[idx] - ax) * dx + (y[idx] - ay) * dy)
+            / np.where(length2 > 0, length2, 1),
+            0,
+            1,
+        )
+        d = np.hypot(x[idx] - ax - t * dx, y[idx] - ay - t * dy)
+
+        # split each interval at its farthest point
+        d_max = np.maximum.reduceat(d, offsets)
+        is_max = np.flatnonzero(d == d_max[interval])
+        first = is_max[np.diff(interval[is_max], prepend=-1) > 0]
+        mid = idx[first]
+        # a point is not kept at a larger tolerance than its parent
+        tolerances[mid] = np.minimum(d_max, bounds)
+
+        starts, ends = np.concatenate([starts, mid]), np.concatenate([mid, ends])
+        bounds = np.concatenate([tolerances[mid], tolerances[mid]])
+    return tolerances
+
+
+def track_tolerances(lat, long) -> np.ndarray:
+    """Douglas-Peucker tolerance (m) of each point of a track.
+
+    ## Parameters
+    - lat, long: semicircles, nan/None where missing.
+
+    ## Returns
+    - tolerances (np.ndarray): see ``simplify_tolerances``, 0 for points
+        without position.
+    """
+    lat = np.asarray(lat, dtype=np.float64) * (180 / 2**31)
+    long = np.asarray(long, dtype=np.float64) * (180 / 2**31)
+    valid = ~(np.isnan(lat) | np.isnan(long))
+    tolerances = np.zeros(len(lat))
+    if valid.any():
+        m_per_deg = 6371000 * pi / 180
+        cos_lat = np.cos(np.radians(np.mean(lat[valid])))
+        tolerances[valid] = simplify_tolerances(
+            long[valid] * cos_lat * m_per_deg, lat[valid] * m_per_deg
+        )
+    return tolerances
+
+
+def lod_indices(tolerances: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of the max_points points with largest tolerance, in order."""
+    if len(tolerances) <= max_points:
+        return np.arange(len(tolerances))
+    keep = np.argsort(-tolerances, kind="stable")[:max_points]
+    return np.sort(keep)
+
+
+def minmax_downsample(values: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Indices of the first, last, smallest and largest value in each of
+    n_buckets equal parts of a series, in order. Keeps peaks and valleys.
+
+    Missing values (nan) are never picked, unless a bucket has nothing else.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= 2 * n_buckets + 2:
+        return np.arange(n)
+    bucket = np.arange(n) * n_buckets // n
+    low = np.lexsort((np.where(np.isnan(values), np.inf, values), bucket))
+    high = np.lexsort((np.where(np.isnan(values), -np.inf, values), bucket))
+    first = np.flatnonzero(np.diff(bucket[low], prepend=-1))
+    last = np.append(first[1:] - 1, n - 1)
+    return np.unique(np.concatenate([[0, n - 1], low[first], high[last]]))
+
+
+def minmax_levels(values: np.ndarray, levels) -> np.ndarray:
+    """Smallest level k where ``minmax_downsample(values, 2**k)`` picks each
+    value, 255 if none of levels.
+    """
+    result = np.full(len(values), 255, dtype=np.uint8)
+    for k in sorted(levels, reverse=True):
+        result[minmax_downsample(values, 2**k)] = k
+    return result
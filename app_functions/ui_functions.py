@@ -1,4 +1,5 @@
 import os
+import re
 from datetime import datetime
 import polars as pl
 
@@ -27,6 +28,11 @@ STYLES = {
         "height": "40px",
     },
 }
+# search for activities near a point: "near:lat,long" or "near:lat,long,km"
+NEAR_QUERY_RE = re.compile(
+    r"^\s*near:\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*(?:,\s*([\d.]+)\s*)?$"
+)
+NEAR_DEFAULT_KM = 10
 
 
 def main_greeting(act_index: pl.DataFrame = None) -> dcc.Markdown:
@@ -54,25 +60,56 @@ def main_greeting(act_index: pl.DataFrame = None) -> dcc.Markdown:
 
         lines.append(f"- You have {n_act} activities.")
         lines.append("    - Total distance %.1f km." % (total_len / 1000))
+        if "elev_gain" in act_index.columns:
+            total_gain = act_index["elev_gain"].sum()
+            lines.append("    - Total climbing %.0f m." % total_gain)
 
     info_md = dcc.Markdown(children="\n ".join(lines))
     return info_md
 
 
-def activity_list(act_index: pl.DataFrame) -> html.Div:
-    """Create a list of all activities."""
+def parse_near_query(text: str):
+    """Point and radius of a "near:lat,long[,km]" search, None for other text.
+
+    ## Returns
+    - near (tuple | None): lat, long (degrees), radius (km)
+    """
+    match = NEAR_QUERY_RE.match(text or "")
+    if match is None:
+        return None
+    try:
+        lat, long = float(match[1]), float(match[2])
+        radius = float(match[3]) if match[3] else NEAR_DEFAULT_KM
+    except ValueError:
+        return None
+    return lat, long, radius
 
+
+def activity_rows(act_index: pl.DataFrame) -> list[dict]:
+    """Rows of the activity list."""
     data = act_index.with_columns(pl.col("start_time").alias("date")).drop(
         "start_time", "end_time"
     )
+    return (
+        data.select("id", "n_points", "date", "length", "sport_spec")
+        .to_pandas()
+        .to_dict("records")
+    )
+
+
+def activity_list(act_index: pl.DataFrame) -> html.Div:
+    """Create a list of all activities.
+
+    Rows are identified by activity id (``cellClicked["rowId"]``), so they can
+    be filtered, e.g. by a "near:lat,long,km" search.
+    """
     # to parse datetimes
     date_obj = "d3.utcParse('%Y-%m-%dT%H:%M:%S%Z')(params.data.date)"
 
     grid = dag.AgGrid(
         id="grid-acts",
-        rowData=data.select("id", "n_points", "date", "length", "sport_spec")
-        .to_pandas()
-        .to_dict("records"),
+        rowData=activity_rows(act_index),
+        getRowId="params.data.id",
         columnDefs=[
             {
                 "field": "date",
@@ -96,7 +133,7 @@ def activity_list(act_index: pl.DataFrame) -> html.Div:
 
     searchbar = dcc.Input(
         id="searchbar-acts",
-        placeholder="search... (sports, dates, etc...)",
+        placeholder="search... (sports, dates, near:lat,long,km, etc...)",
         style=STYLES["searchbar"],
     )
 
@@ -111,6 +148,9 @@ def activity_list(act_index: pl.DataFrame) -> html.Div:
 def update_activity_filter(filter_value):
     """Callback. Apply a quick filter to activity list"""
     newFilter = Patch()
+    if parse_near_query(filter_value) is not None:
+        # rows are filtered by the page, see ``summary_view.search_near``
+        filter_value = ""
     newFilter["quickFilterText"] = filter_value
     return newFilter
 
@@ -32,7 +32,7 @@ PLOT_CONFIG = {
 }
 
 
-act_index = dataf.load_parquet(
+act_index = dataf.load_index(
     "data/activity_index.parquet", cols_required={"id", "n_points", "start_time"}
 )
 
@@ -6,7 +6,8 @@ import polars as pl
 DATA_DIR = "data/points_parquet"
 INDEX_PATH = "data/activity_index.parquet"
 
-act_index = dataf.load_parquet(INDEX_PATH)
+deltas = dataf.index_deltas(INDEX_PATH)
+act_index = dataf.load_index(INDEX_PATH)
 
 print("act index: ", len(act_index))
 print(act_index.columns)
@@ -25,4 +26,4 @@ act_index = act_index.join(metadata, on="id")
 
 print(act_index)
 
-print(dataf.safe_save(act_index, INDEX_PATH, check_read=True))
+print(dataf.save_index(INDEX_PATH, act_index, deltas))
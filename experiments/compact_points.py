@@ -0,0 +1,29 @@
+"""
+Convert activity points to the compact format and compare size and load time.
+"""
+
+import os
+from time import perf_counter
+
+import polars as pl
+
+from app_functions import data_functions as dataf
+
+ACT_DIR = os.path.join("data", "points_parquet")
+COMPACT_DIR = os.path.join("data", "points_compact")
+
+os.makedirs(COMPACT_DIR, exist_ok=True)
+sizes = dataf.convert_compact(ACT_DIR, COMPACT_DIR)
+print(sizes.select(pl.len(), pl.col("size", "size_compact").sum()))
+
+
+def load_all(folder: str):
+    files = dataf.find_importable(folder, [".parquet"])
+    t = perf_counter()
+    for path in files["path"]:
+        dataf.load_parquet(path)
+    return perf_counter() - t
+
+
+for folder in (ACT_DIR, COMPACT_DIR):
+    print(f"{folder}: load all {load_all(folder):.2f}s")
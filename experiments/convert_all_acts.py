@@ -3,9 +3,15 @@ import os
 
 folder_in = os.path.join("data", "activities")
 folder_parquet = os.path.join("data", "points_parquet")
+manifest_path = os.path.join("data", "import_manifest.parquet")
 
-files = dataf.find_importable(folder_in, [".fit"])
-print(files)
+if __name__ == "__main__":
+    files = dataf.find_importable(folder_in, dataf.CONVERT_TYPES)
+    print(files)
 
-dataf.convert_all_fit_polars(folder_in, folder_parquet, overwrite=True)
- 
\ No newline at end of file
+    dataf.convert_all_polars(
+        folder_in,
+        folder_parquet,
+        workers=os.cpu_count(),
+        manifest_path=manifest_path,
+    )
@@ -5,11 +5,10 @@ import polars as pl
 
 from timeit import timeit
 
-
 ACT_DIR = "data/points_parquet"
 INDEX_PATH = "data/activity_index.parquet"
 
-act_index = dataf.load_parquet(INDEX_PATH)
+act_index = dataf.load_index(INDEX_PATH)
 
 act_id = act_index.sort("start_time")[-1, "id"]
 
@@ -21,27 +20,15 @@ print(act_index.head())
 
 
 def compute_all_lengths(act_index: pl.DataFrame):
-    lengths = []
-
-    for act in act_index.iter_rows(named=True):
-        try:
-            act = dataf.load_parquet(
-                os.path.join(ACT_DIR, act["id"] + ".parquet"),
-                cols_required={"lat", "long"},
-            )
-        except ValueError:
-            lengths.append(None)
-            continue
-
-        dist = statsf.trace_distance(act)
-        lengths.append(dist[-1, "dist_km"])
-
-    return pl.concat(
-        [
-            act_index.select("id"),
-            pl.DataFrame(lengths, schema={"length": pl.Float32}),
-        ],
-        how="horizontal",
+    files = [os.path.join(ACT_DIR, a + ".parquet") for a in act_index["id"]]
+    lengths = statsf.activity_lengths(dataf.scan_point_files(files)).collect(
+        engine="streaming"
+    )
+    return act_index.select("id").join(
+        lengths.select("id", pl.col("length").cast(pl.Float32)),
+        on="id",
+        how="left",
+        maintain_order="left",
     )
 
 
@@ -53,7 +40,7 @@ if __name__ == "__main__":
     # act_index = act_index.drop("length").join(lengths, on="id")
     # print(act_index.sort("start_time").tail())
 
-    # dataf.safe_save(act_index, INDEX_PATH)
+    # dataf.save_index(INDEX_PATH, act_index)
 
     dist_hav = statsf.trace_distance(act, "haversine")
 
@@ -71,3 +58,7 @@ if __name__ == "__main__":
         timeit(lambda: statsf.trace_distance(act, "small-angle"), number=N_TIMEIT)
         / N_TIMEIT,
     )
+    print(
+        "compute time all lengths:",
+        timeit(lambda: compute_all_lengths(act_index), number=N_TIMEIT) / N_TIMEIT,
+    )
@@ -0,0 +1,19 @@
+"""
+Update the heatmap tiles served by ``app.py`` to the activity index.
+"""
+
+import os
+from time import perf_counter
+
+from app_functions import data_functions as dataf
+
+ACT_DIR = os.path.join("data", "points_parquet")
+INDEX_PATH = os.path.join("data", "activity_index.parquet")
+HEATMAP_DIR = os.path.join("data", "heatmap_tiles")
+
+act_index = dataf.load_index(INDEX_PATH)
+tiles = dataf.HeatmapTiles(HEATMAP_DIR)
+
+t = perf_counter()
+n_tiles = tiles.update(act_index, ACT_DIR, verbose=True)
+print(f"{n_tiles} tiles updated in {perf_counter() - t:.1f}s")
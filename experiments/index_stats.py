@@ -12,7 +12,7 @@ ACT_DIR = "data/points_parquet"
 INDEX_PATH = "data/activity_index.parquet"
 
 tmp = default_timer()
-act_index = dataf.load_parquet(INDEX_PATH)
+act_index = dataf.load_index(INDEX_PATH)
 t_load_index = default_timer() - tmp
 
 # for now, only main sports
@@ -0,0 +1,24 @@
+"""
+Move activity points from one file per activity to one dataset per year.
+"""
+
+import os
+
+import polars as pl
+
+from app_functions import data_functions as dataf
+
+ACT_DIR = os.path.join("data", "points_parquet")
+DATASET_DIR = os.path.join("data", "points_dataset")
+
+added = dataf.migrate_points_dataset(ACT_DIR, DATASET_DIR)
+print(f"added {len(added)} activities")
+
+# archive-wide queries are one lazy scan
+print(
+    dataf.scan_points_dataset(DATASET_DIR)
+    .group_by("year")
+    .agg(points=pl.len(), activities=pl.col("id").n_unique())
+    .sort("year")
+    .collect()
+)
@@ -0,0 +1,33 @@
+"""
+Find all efforts on a segment, taken from the latest activity, and time a
+second (cached) search.
+"""
+
+import os
+from time import perf_counter
+
+from app_functions import data_functions as dataf
+
+ACT_DIR = os.path.join("data", "points_parquet")
+INDEX_PATH = os.path.join("data", "activity_index.parquet")
+CACHE_DIR = os.path.join("data", "cache_segments")
+
+act_index = dataf.load_index(INDEX_PATH)
+spatial = dataf.SpatialIndex.for_index(INDEX_PATH, act_index)
+
+# a coarse segment (every 60th of the first 600 points) of the latest activity,
+# which should give at least its effort
+act_id = act_index.sort("start_time")[-1, "id"]
+act = dataf.load_parquet(
+    os.path.join(ACT_DIR, act_id + ".parquet"), columns=["lat", "long"]
+).drop_nulls()
+segment = act[:600:60].to_numpy() * (180 / 2**31)
+
+for run in ("first", "cached"):
+    t = perf_counter()
+    efforts = dataf.segment_efforts(
+        segment, act_index, ACT_DIR, spatial, cache_dir=CACHE_DIR, verbose=True
+    )
+    print(f"{run}: {perf_counter() - t:.3f}s")
+
+print(efforts)
@@ -0,0 +1,50 @@
+"""
+## Malformed source files are rejected with ValueError
+
+- A gpx file with an unparsable `<time>`, and a csv file with a non-numeric
+  position, raise ValueError (not a polars error), so the import skips them.
+- Run from the repository root.
+
+"""
+
+import os
+import tempfile
+import app_functions.data_functions as dataf
+
+GPX = os.path.join("data_test", "activity_15589755789.gpx")
+
+
+def expect_value_error(filepath):
+    try:
+        dataf.convert_polars(filepath)
+    except ValueError as e:
+        print(f"{os.path.basename(filepath)}: {e}")
+    else:
+        raise AssertionError(f"no error for {filepath}")
+
+
+with tempfile.TemporaryDirectory() as folder:
+    with open(GPX, encoding="utf8") as f:
+        gpx = f.read()
+    time = gpx[gpx.index("<time>", gpx.index("<trkpt")) :].split("</time>")[0]
+    bad_time = os.path.join(folder, "bad_time.gpx")
+    with open(bad_time, "w", encoding="utf8") as f:
+        f.write(gpx.replace(time, "<time>yesterday", 1))
+    expect_value_error(bad_time)
+
+    bad_cell = os.path.join(folder, "bad_cell.csv")
+    with open(bad_cell, "w", encoding="utf8") as f:
+        f.write("time,lat,lon,hr\n")
+        f.write("2024-05-26T12:07:34Z,55.6,13.0,100\n")
+        f.write("2024-05-26T12:07:35Z,abc,13.0,101\n")
+    expect_value_error(bad_cell)
+
+    # both are skipped by a batch import, next to a good file
+    good = os.path.join(folder, "good.gpx")
+    with open(good, "w", encoding="utf8") as f:
+        f.write(gpx)
+    os.makedirs(os.path.join(folder, "out"))
+    converted = dataf.convert_all_polars(folder, os.path.join(folder, "out"))
+    assert converted == ["good"], converted
+
+print("ok")
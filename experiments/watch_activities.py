@@ -0,0 +1,24 @@
+"""
+Watch the activities folder and import new files as they arrive.
+"""
+
+import os
+
+from app_functions import data_functions as dataf
+
+folder_in = os.path.join("data", "activities")
+folder_parquet = os.path.join("data", "points_parquet")
+manifest_path = os.path.join("data", "import_manifest.parquet")
+index_path = os.path.join("data", "activity_index.parquet")
+heatmap_dir = os.path.join("data", "heatmap_tiles")
+
+if __name__ == "__main__":
+    dataf.watch_folder(
+        folder_in,
+        folder_parquet,
+        index_path,
+        manifest_path,
+        interval=2.0,
+        debounce=2.0,
+        heatmap_dir=heatmap_dir,
+    )
@@ -23,6 +23,8 @@ from app_functions import ui_functions as uif
 register_page(__name__)
 
 ACT_DIR = os.path.join("data", "points_parquet")
+CACHE_DIR = os.path.join("data", "cache_ipc", "lod")
+LOD_DIR = os.path.join("data", "points_lod")
 
 
 class Act:
@@ -36,6 +38,7 @@ class Act:
 
 
 act = Act()
+lod_cache = dataf.ActivityCache(CACHE_DIR)
 act_id = None
 
 graph_geo = dcc.Graph(figure=go.Figure(), id="graph-geo")
@@ -43,7 +46,7 @@ info_text = html.Div(children="pick an activity...", id="info-act")
 
 
 def layout():
-    return ([info_text, graph_geo])
+    return [info_text, graph_geo]
 
 
 ## CALLBACKS ##
@@ -60,7 +63,7 @@ def update_current(data: dict):
 
         if act_id_new != act.id:
             act.id = data["current_act_id"]
-            act.act_df = dataf.load_parquet(os.path.join(ACT_DIR, act.id + ".parquet"))
+            act.act_df = dataf.load_lod(act.id, LOD_DIR, ACT_DIR, cache=lod_cache)
 
             print(act.id)
             fig_act = plotf.plot_points_geo(act.act_df["lat"], act.act_df["long"])
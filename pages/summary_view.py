@@ -1,3 +1,8 @@
+import os
+
+import flask
+import polars as pl
+
 import dash_bootstrap_components as dbc
 from dash import (
     Input,
@@ -10,6 +15,7 @@ from dash import (
     ctx,
     register_page,
 )
+from plotly import graph_objects as go
 
 from app_functions import data_functions as dataf
 from app_functions import stats_functions as statsf
@@ -23,9 +29,49 @@ PLOT_CONFIG = {
     "displaylogo": False,
     "modeBarButtonsToRemove": ["select", "autoScale"],
 }
-act_index = dataf.load_parquet(
-    "data/activity_index.parquet", cols_required={"id", "n_points", "start_time"}
-)
+INDEX_PATH = "data/activity_index.parquet"
+ACT_DIR = os.path.join("data", "points_parquet")
+LOD_DIR = os.path.join("data", "points_lod")
+# tiles served by app.py, updated by the importer (see watch_activities.py)
+HEATMAP_URL = "heatmap/{z}/{x}/{y}.png"
+MAX_REGIONS = 10  # choices of the map region selector
+act_index = dataf.load_index(INDEX_PATH, cols_required={"id", "n_points", "start_time"})
+index_mtime = dataf.index_mtime_ns(INDEX_PATH)
+spatial_index = None
+regions = None
+
+
+def refresh_index():
+    """Reload the activity index if the file changed, e.g. by the importer."""
+    global act_index, index_mtime, spatial_index, regions
+
+    mtime = dataf.index_mtime_ns(INDEX_PATH)
+    if mtime != index_mtime:
+        act_index = dataf.load_index(
+            INDEX_PATH, cols_required={"id", "n_points", "start_time"}
+        )
+        index_mtime = mtime
+        spatial_index = None
+        regions = None
+
+
+def get_spatial_index() -> dataf.SpatialIndex:
+    """Spatial index of the activity index, loaded on first use."""
+    global spatial_index
+
+    if spatial_index is None:
+        spatial_index = dataf.SpatialIndex.for_index(INDEX_PATH, act_index)
+    return spatial_index
+
+
+def get_regions() -> pl.DataFrame:
+    """Regions of the activity starts, busiest first, loaded on first use."""
+    global regions
+
+    if regions is None:
+        regions = dataf.load_regions(INDEX_PATH, act_index)
+    return regions
+
 
 summary = statsf.summary_interval(act_index, "1mo")
 
@@ -38,8 +84,6 @@ buttons_summary_interval = html.Div(
     ],
 )
 
-act_list = uif.activity_list(act_index)
-
 
 @callback(
     Output("graph-summary", "figure"),
@@ -66,27 +110,78 @@ def update_graph_summary(*args):
     raise exceptions.PreventUpdate()
 
 
+def heatmap_map(region: int = None) -> go.Figure:
+    """Map of the heatmap of all activities, with the latest activity on top.
+
+    Shows a region of ``get_regions`` if given, else the latest activity.
+    """
+    if act_index.is_empty():
+        return go.Figure()
+    latest = act_index.sort("start_time")[-1, "id"]
+    view = None
+    if region is not None:
+        # regions are boxes of start points, show the tracks around them
+        pad = 2 * dataf.REGION_CELL_DEG
+        view = (
+            get_regions()
+            .filter(pl.col("region") == region)
+            .select(
+                pl.col("min_lat", "min_long") - pad, pl.col("max_lat", "max_long") + pad
+            )
+            .select("min_lat", "max_lat", "min_long", "max_long")
+        )
+        view = view.row(0) if len(view) else None
+    return plotf.points_map(
+        dataf.load_lod(latest, LOD_DIR, ACT_DIR),
+        heatmap_url=flask.request.host_url + HEATMAP_URL,
+        view=view,
+    )
+
+
+def region_selector() -> dcc.Dropdown:
+    """Choice of the region shown on the map, the busiest at first."""
+    options = []
+    if not act_index.is_empty():
+        options = [
+            {"label": f"Region {r + 1} ({n} activities)", "value": r}
+            for r, n in get_regions().head(MAX_REGIONS).select("region", "count").rows()
+        ]
+    return dcc.Dropdown(
+        id="dd-region",
+        options=options,
+        value=options[0]["value"] if options else None,
+        clearable=False,
+    )
+
+
 # components
-greeting = uif.main_greeting(act_index)
 summary_graph = dcc.Graph(
     id="graph-summary",
     figure=plotf.multi_summary_hist([summary], interval="1mo"),
     config={"displayModeBar": False, "scrollZoom": True},
 )
 
-col_left = dbc.Col(
-    children=[
-        greeting,
-        buttons_summary_interval,
-        dcc.Loading(summary_graph),
-    ]
-)
-col_right = dbc.Col(children=[act_list])
-cols = dbc.Row(children=[col_left, col_right])
-
 
 def layout():
-    return cols
+    """Build the page, picking up activities imported since the last visit."""
+    refresh_index()
+    col_left = dbc.Col(
+        children=[
+            uif.main_greeting(act_index),
+            buttons_summary_interval,
+            dcc.Loading(summary_graph),
+            region_selector(),
+            dcc.Graph(id="graph-map", config=PLOT_CONFIG),
+        ]
+    )
+    col_right = dbc.Col(
+        children=[
+            uif.activity_list(act_index),
+            # per client: whether the list shows a near search
+            dcc.Store(id="store-near-filtered", data=False),
+        ]
+    )
+    return dbc.Row(children=[col_left, col_right])
 
 
 ## CALLBACKS ##
@@ -99,12 +194,40 @@ def layout():
 )
 def select_activity(cell: dict, data: dict):
     if cell:
-        data["current_act_id"] = act_index[int(cell["rowId"]), "id"]
+        data["current_act_id"] = cell["rowId"]
         return data
 
     raise exceptions.PreventUpdate()
 
 
+@callback(
+    Output("grid-acts", "rowData"),
+    Output("store-near-filtered", "data"),
+    Input("searchbar-acts", "value"),
+    State("store-near-filtered", "data"),
+    prevent_initial_call=True,
+)
+def search_near(filter_value: str, near_filtered: bool):
+    """Callback. Show only activities near a point, for "near:lat,long,km"."""
+    near = uif.parse_near_query(filter_value)
+    if near is not None:
+        ids = get_spatial_index().within(*near)
+        return uif.activity_rows(act_index.filter(pl.col("id").is_in(ids))), True
+    if near_filtered:
+        return uif.activity_rows(act_index), False
+
+    raise exceptions.PreventUpdate()
+
+
+@callback(
+    Output("graph-map", "figure"),
+    Input("dd-region", "value"),
+)
+def update_map(region: int):
+    """Callback. Show the selected region on the heatmap."""
+    return heatmap_map(region)
+
+
 @callback(
     Output("info-store", "children"),
     Input("store", "data"),